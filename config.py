@@ -8,3 +8,8 @@ load_dotenv(DOTENV_PATH)
 DATA_DIR = os.environ.get('DATA_DIR', os.path.join(ROOT_DIR, 'res', 'Data'))
 RES_DIR = os.environ.get('INDEX_DIR', os.path.join(ROOT_DIR, 'res'))
 QUERIES_DIR = os.environ.get('QUERIES_DIR', os.path.join(ROOT_DIR, 'res', 'Queries'))
+
+# Pool of workers that process the documents of the collections (see src.interface.DocumentPool)
+WORKERS = int(os.environ.get('WORKERS', os.cpu_count() or 1))
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 64))
+EXECUTOR = os.environ.get('EXECUTOR', 'thread')
@@ -0,0 +1,243 @@
+# This file gathers the codecs that can be used to compress the entries of the indexes (sequences of integers >= 0)
+# Each entry is encoded on a whole number of bytes, so that it can be read alone from its offset in the index file
+import numpy as np
+from src.compression.vb_encoding import encode_array, encode_entries, decode_array
+
+
+class Codec:
+    """
+        Interface of the codecs : encode() turns a sequence of integers into bytes and decode() does the opposite.
+        name is recorded in the metadata of the indexes, suffix is used in the names of their folders and files
+    """
+    name = None
+    suffix = None
+
+    def encode(self, nums):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+    def encode_entries(self, entries):
+        """ Encode several entries and return the bytes and the number of bytes of each entry """
+        encoded = [self.encode(entry) for entry in entries]
+        return b''.join(encoded), [len(data) for data in encoded]
+
+    def decode_entries(self, data, lengths):
+        """ Decode consecutive entries whose numbers of bytes are given """
+        entries = list()
+        offset = 0
+        for length in lengths:
+            entries.append(self.decode(data[offset:offset + length]))
+            offset += length
+        return entries
+
+
+class VariableByte(Codec):
+    """ Variable Byte Encoding (see vb_encoding.py) : 7 bits of the number per byte """
+    name = 'vb'
+    suffix = 'VBE'
+
+    def encode(self, nums):
+        return encode_array(nums)
+
+    def decode(self, data):
+        return decode_array(data).tolist()
+
+    def encode_entries(self, entries):
+        return encode_entries(entries)
+
+    def decode_entries(self, data, lengths):
+        # All numbers are decoded at once, then split where the entries end
+        nums = decode_array(data).tolist()
+        stops = np.cumsum(np.frombuffer(data, dtype=np.uint8) >= 128)
+        ends = [int(stops[end - 1]) if end > 0 else 0 for end in np.cumsum(lengths)]
+        return [nums[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+
+# Bit oriented codecs : the code of each number is built as a string of '0' and '1', the entry is padded with zeros
+def bits_to_bytes(bits):
+    bits += '0' * (-len(bits) % 8)
+    return int(bits, 2).to_bytes(len(bits) // 8, 'big') if bits else b''
+
+
+def bytes_to_bits(data):
+    return bin(int.from_bytes(data, 'big'))[2:].zfill(8 * len(data)) if data else ''
+
+
+def gamma_code(n):
+    """ Elias gamma code of n >= 1 : as many zeros as the number of bits of n after the first one, then n """
+    bits = bin(n)[2:]
+    return '0' * (len(bits) - 1) + bits
+
+
+def read_gamma(bits, position):
+    """ Return (n, new position), or (None, position) if only padding is left """
+    first_one = bits.find('1', position)
+    if first_one < 0:
+        return None, position
+    end = 2 * first_one - position + 1
+    return int(bits[first_one:end], 2), end
+
+
+class EliasGamma(Codec):
+    """ Elias gamma : about 2 log2(n) bits per number, numbers are shifted by one since 0 has no code """
+    name = 'gamma'
+    suffix = 'Gamma'
+
+    def encode(self, nums):
+        return bits_to_bytes(''.join(gamma_code(num + 1) for num in nums))
+
+    def decode(self, data):
+        bits = bytes_to_bits(data)
+        nums = list()
+        position = 0
+        while True:
+            num, position = read_gamma(bits, position)
+            if num is None:
+                return nums
+            nums.append(num - 1)
+
+
+class EliasDelta(Codec):
+    """ Elias delta : the number of bits of n is written in gamma, then n without its first bit """
+    name = 'delta'
+    suffix = 'Delta'
+
+    def encode(self, nums):
+        return bits_to_bytes(''.join(gamma_code((num + 1).bit_length()) + bin(num + 1)[3:] for num in nums))
+
+    def decode(self, data):
+        bits = bytes_to_bits(data)
+        nums = list()
+        position = 0
+        while True:
+            length, position = read_gamma(bits, position)
+            if length is None:
+                return nums
+            nums.append(int('1' + bits[position:position + length - 1], 2) - 1)
+            position += length - 1
+
+
+class Simple8b(Codec):
+    """
+        Simple-8b : numbers are packed in 64 bits words, whose first 4 bits (selector) tell how many numbers
+        of how many bits the 60 other bits contain. Numbers must be lower than 2^60
+    """
+    name = 'simple8b'
+    suffix = 'S8b'
+
+    # selector -> (number of values, bits per value), the first two selectors are runs of zeros
+    SELECTORS = [(240, 0), (120, 0), (60, 1), (30, 2), (20, 3), (15, 4), (12, 5), (10, 6),
+                 (8, 7), (7, 8), (6, 10), (5, 12), (4, 15), (3, 20), (2, 30), (1, 60)]
+
+    def encode(self, nums):
+        nums = list(nums)
+        words = list()
+        position = 0
+        while position < len(nums):
+            for selector, (count, bits) in enumerate(self.SELECTORS):
+                values = nums[position:position + count]
+                if len(values) == count and max(values) < (1 << bits):
+                    word = selector << 60
+                    for i, value in enumerate(values):
+                        word |= value << (bits * i)
+                    words.append(word)
+                    position += count
+                    break
+            else:
+                raise ValueError("Simple-8b can't encode %i (2^60 or more)" % nums[position])
+        return np.array(words, dtype='<u8').tobytes()
+
+    def decode(self, data):
+        nums = list()
+        for word in np.frombuffer(data, dtype='<u8').tolist():
+            count, bits = self.SELECTORS[word >> 60]
+            if bits == 0:
+                nums.extend([0] * count)
+            else:
+                mask = (1 << bits) - 1
+                nums.extend((word >> (bits * i)) & mask for i in range(count))
+        return nums
+
+
+def read_vb(data, position):
+    """ Read one number written with Variable Byte Encoding and return (number, new position) """
+    num = 0
+    while data[position] < 128:
+        num = 128 * num + data[position]
+        position += 1
+    return 128 * num + data[position] - 128, position + 1
+
+
+class PForDelta(Codec):
+    """
+        Frame of reference with patched exceptions : numbers are cut in blocks of 128, and in each block the
+        differences to the smallest number are packed on the few bits that are enough for 90% of them.
+        The higher bits of the others (exceptions) are written afterwards with their positions.
+        Block = length, reference, bits, number of exceptions (in VB), packed bits, then position and high bits
+        of each exception (in VB)
+    """
+    name = 'pfor'
+    suffix = 'PFor'
+
+    BLOCK_SIZE = 128
+    COVERAGE = 0.9
+
+    def encode(self, nums):
+        nums = list(nums)
+        data = bytearray()
+        for start in range(0, len(nums), self.BLOCK_SIZE):
+            block = nums[start:start + self.BLOCK_SIZE]
+            reference = min(block)
+            offsets = [num - reference for num in block]
+            bits = sorted(offset.bit_length() for offset in offsets)[int(self.COVERAGE * (len(block) - 1))]
+            mask = (1 << bits) - 1
+            exceptions = [(i, offset >> bits) for i, offset in enumerate(offsets) if offset > mask]
+
+            packed = 0
+            for i, offset in enumerate(offsets):
+                packed |= (offset & mask) << (bits * i)
+            data += encode_array([len(block), reference, bits, len(exceptions)])
+            data += packed.to_bytes((bits * len(block) + 7) // 8, 'little')
+            data += encode_array([num for exception in exceptions for num in exception])
+        return bytes(data)
+
+    def decode(self, data):
+        nums = list()
+        position = 0
+        while position < len(data):
+            header = list()
+            for _ in range(4):
+                num, position = read_vb(data, position)
+                header.append(num)
+            length, reference, bits, nb_exceptions = header
+
+            size = (bits * length + 7) // 8
+            packed = int.from_bytes(data[position:position + size], 'little')
+            position += size
+            mask = (1 << bits) - 1
+            offsets = [(packed >> (bits * i)) & mask for i in range(length)]
+
+            for _ in range(nb_exceptions):
+                i, position = read_vb(data, position)
+                high, position = read_vb(data, position)
+                offsets[i] |= high << bits
+            nums.extend(reference + offset for offset in offsets)
+        return nums
+
+
+CODECS = {codec.name: codec for codec in [VariableByte(), EliasGamma(), EliasDelta(), Simple8b(), PForDelta()]}
+
+
+def get_codec(name):
+    if name not in CODECS:
+        raise ValueError("unknown codec '%s', available codecs are %s" % (name, ', '.join(sorted(CODECS))))
+    return CODECS[name]
+
+
+if __name__ == "__main__":
+    example = [0, 1, 5, 127, 128, 300, 16384, 3, 3, 0]
+    for codec in CODECS.values():
+        data = codec.encode(example)
+        print("%s : %i bytes, decoded %s" % (codec.name, len(data), codec.decode(data)))
@@ -0,0 +1,57 @@
+# Comparison of the codecs of codecs.py on the postings of the indexes already built (Index_Freq)
+# For each codec : size of the postings (bits per posting) and speed of decoding (postings per second)
+import time
+from src.compression.codecs import CODECS
+from src.compression.vb_encoding import to_gaps
+from src.searching.index_reader import FreqIndex
+
+
+def read_entries(collection):
+    """
+        Entries of the compressed indexes, built from the Frequency index of the collection :
+        DocID entries = term_id count gap1 gap2..., Freq entries = term_id count gap1 freq1 gap2 freq2...
+    """
+    index = FreqIndex(collection)
+    term_ids = [term_id for term_id in range(len(index.directory)) if term_id in index.directory]
+    doc_entries, freq_entries = list(), list()
+    for term_id, (count, postings) in sorted(index.get_related_documents(term_ids).items()):
+        doc_ids, freqs = zip(*sorted(postings.items()))
+        gaps = to_gaps(doc_ids)
+        doc_entries.append([term_id, count] + gaps)
+        freq_entries.append([term_id, count] + [num for gap, freq in zip(gaps, freqs) for num in (gap, freq)])
+    return doc_entries, freq_entries
+
+
+def compare_codecs(entries, repeat=3):
+    """ Return {codec name: (bits per posting, encoding time, postings decoded per second)} for the given entries """
+    nb_postings = sum(entry[1] for entry in entries)
+    results = dict()
+    for name, codec in CODECS.items():
+        start = time.time()
+        data, lengths = codec.encode_entries(entries)
+        encoding_time = time.time() - start
+
+        start = time.time()
+        for _ in range(repeat):
+            decoded = codec.decode_entries(data, lengths)
+        decoding_time = (time.time() - start) / repeat
+        if decoded != entries:
+            raise ValueError("codec %s doesn't decode what it has encoded" % name)
+
+        results[name] = (8 * len(data) / max(1, nb_postings), encoding_time, nb_postings / max(decoding_time, 1e-9))
+    return results
+
+
+def display_comparison(title, results):
+    print(title)
+    print("%-10s %16s %14s %22s" % ("codec", "bits / posting", "encoding (s)", "decoding (postings/s)"))
+    for name, (bits, encoding_time, throughput) in sorted(results.items(), key=lambda item: item[1][0]):
+        print("%-10s %16.2f %14.3f %22.0f" % (name, bits, encoding_time, throughput))
+    print("")
+
+
+if __name__ == "__main__":
+    for collection in ['CACM', 'CS276']:
+        doc_entries, freq_entries = read_entries(collection)
+        display_comparison("--- DocID index : Collection %s ---" % collection, compare_codecs(doc_entries))
+        display_comparison("--- Frequency index : Collection %s ---" % collection, compare_codecs(freq_entries))
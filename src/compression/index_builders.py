@@ -1,135 +1,123 @@
-import os
 import itertools
+import os
 from src.indexing.doc_index import DocBSBI
 from src.indexing.freq_index import FreqBSBI
 from config import RES_DIR
 
-from src.compression.vb_encoding import byte_encode, byte_decode
+from src.compression.codecs import VariableByte
+from src.compression.vb_encoding import to_gaps, from_gaps
+
+# Version of the layout of the compressed entries, recorded in meta.txt :
+# 1 = ids written as they are, 2 = sorted doc_ids (and term_ids in the non inversed index) written as gaps
+VBE_FORMAT_VERSION = 2
+
+# Entries are encoded and decoded by chunks : codecs are faster on many entries at once, and memory stays bounded
+CHUNK_SIZE = 4096
+
+
+def read_compressed_entries(path, codec, offset=0):
+    """
+        Decode one after the other the entries of a compressed file from offset,
+        located with its directory (path + _dir.txt)
+    """
+    with open(path + '.txt', "rb") as file, open(path + '_dir.txt', "r") as directory:
+        file.seek(offset)
+        lines = (line for line in directory if int(line.split()[1]) >= offset)
+        while True:
+            lengths = [int(line.split()[2]) for line in itertools.islice(lines, CHUNK_SIZE)]
+            if len(lengths) == 0:
+                return
+            yield from codec.decode_entries(file.read(sum(lengths)), lengths)
+
+
+def write_compressed_entries(path, codec, entries, append=False):
+    """ Encode entries (lists of integers) and write them, return the directory {id: (offset, length, count)} """
+    directory = dict()
+    with open(path + '.txt', "ab" if append else "wb") as file:
+        offset = file.tell()
+        while True:
+            chunk = list(itertools.islice(entries, CHUNK_SIZE))
+            if len(chunk) == 0:
+                return directory
+            data, lengths = codec.encode_entries(chunk)
+            file.write(data)
+            for entry, length in zip(chunk, lengths):
+                directory[entry[0]] = (offset, length, entry[1])
+                offset += length
 
 
 class DocVBE(DocBSBI):
     """
         This class rewrites the methods of BocBSBI that write in index files (or read them for merging)
-        in order to create compressed indexes
+        in order to create compressed indexes. The codec (Variable Byte Encoding by default, see codecs.py)
+        gives its suffix to the folder and the files of the index
     """
 
-    def __init__(self, collection):
-        DocBSBI.__init__(self, collection)
-        self.index_type = "IndexVBE_DocID"
-
-    def write_block_to_disk(self, postings, block_name):
-        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '_VBE.txt')
-        with open(path, "wb") as file:
-            for term_id, documents in sorted(postings.items()):
-                enc_term_id = byte_encode(term_id)
-                enc_count = byte_encode(len(documents))
-                enc_documents = itertools.chain(*map(byte_encode, documents))
-                file.write(bytes(enc_term_id + enc_count + list(enc_documents)))
-
-    def merge_blocks(self, blocks, final_file):
-        indexes = list()
-
-        # Read all blocks
-        for block_name in blocks:
-            path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '_VBE.txt')
-            index = dict()
-
-            all_nums = []
-            with open(path, "rb") as file:
-                next_num = []
-                for byte in file.read():
-                    next_num.append(byte)
-                    if byte >= 128:
-                        all_nums.append(byte_decode(next_num))
-                        next_num = []
-
-            pointer = 0
-            while pointer < len(all_nums):
-                term_id = all_nums[pointer]
-                count = all_nums[pointer + 1]
-                index[term_id] = all_nums[pointer + 2:pointer + 2 + count]
-                pointer += count + 2
-
-            indexes.append(index)
-            os.remove(path)
-
-        # Merge postings list in memory
-        term_ids = set().union(*indexes)
-        global_index = dict()
-        for term_id in term_ids:
-            postings = set().union(*[set(index.get(term_id, [])) for index in indexes])
-            global_index[term_id] = sorted(list(postings))
-
-        # Write result to disk
-        self.write_block_to_disk(global_index, final_file)
+    def __init__(self, collection, codec=VariableByte(), shards=1, partitions=1):
+        DocBSBI.__init__(self, collection, shards, partitions)
+        self.codec = codec
+        self.suffix = '_' + codec.suffix
+        self.arrays_file = None
+        self.index_type = "Index%s_DocID" % codec.suffix
+        self.metadata['format_version'] = VBE_FORMAT_VERSION
+        self.metadata['codec'] = codec.name
+
+    def write_postings_to_disk(self, entries, file_name):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + self.suffix)
+        # Entry = term_id count gap1 gap2... where gaps are the differences between consecutive doc_ids
+        nums = ([term_id, len(documents)] + to_gaps(documents) for term_id, documents in entries)
+        self.write_directory_to_disk(write_compressed_entries(path, self.codec, nums), file_name + self.suffix)
+
+    def read_block(self, block_name, offset=0):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + self.suffix)
+        for nums in read_compressed_entries(path, self.codec, offset):
+            yield nums[0], from_gaps(nums[2:])
 
 
 class FreqVBE(FreqBSBI):
     """
         This class rewrites the methods of FreqBSBI that write in index files (or read them for merging)
-        in order to create compressed indexes
+        in order to create compressed indexes. The codec (Variable Byte Encoding by default, see codecs.py)
+        gives its suffix to the folder and the files of the index
     """
 
-    def __init__(self, collection):
-        FreqBSBI.__init__(self, collection)
-        self.index_type = "IndexVBE_Freq"
-
-    def write_block_to_disk(self, postings, block_name):
-        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '_VBE.txt')
-        with open(path, "wb") as file:
-            for term_id, documents in sorted(postings.items()):
-                enc_term_id = byte_encode(term_id)
-                enc_count = byte_encode(len(documents))
-                enc_doc_list = [byte_encode(doc_id) + byte_encode(freq) for doc_id, freq in sorted(documents.items())]
-                enc_documents = itertools.chain(*enc_doc_list)
-                file.write(bytes(enc_term_id + enc_count + list(enc_documents)))
+    def __init__(self, collection, codec=VariableByte(), shards=1, partitions=1):
+        FreqBSBI.__init__(self, collection, shards, partitions)
+        self.codec = codec
+        self.suffix = '_' + codec.suffix
+        self.arrays_file = None
+        self.forward_file = None
+        self.index_type = "Index%s_Freq" % codec.suffix
+        self.metadata['format_version'] = VBE_FORMAT_VERSION
+        self.metadata['codec'] = codec.name
+
+    def write_postings_to_disk(self, entries, file_name):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + self.suffix)
+        # Entry = term_id count gap1 freq1 gap2 freq2...
+        nums = ([term_id, len(documents)] + self.interleave(sorted(documents.items()))
+                for term_id, documents in entries)
+        self.write_directory_to_disk(write_compressed_entries(path, self.codec, nums), file_name + self.suffix)
+
+    @staticmethod
+    def interleave(pairs):
+        """ [(id1, freq1), (id2, freq2)...] sorted by id -> [gap1, freq1, gap2, freq2...] """
+        ids, freqs = zip(*pairs)
+        return [num for gap, freq in zip(to_gaps(ids), freqs) for num in (gap, freq)]
 
     def add_block_to_disk(self, postings, file_name):
-        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '_VBE.txt')
-        with open(path, "ab") as file:
-            for doc_id, terms in sorted(postings.items()):
-                enc_term_id = byte_encode(doc_id)
-                enc_count = byte_encode(len(terms))
-                enc_doc_list = [byte_encode(doc_id) + byte_encode(freq) for doc_id, freq in sorted(terms.items())]
-                enc_documents = itertools.chain(*enc_doc_list)
-                file.write(bytes(enc_term_id + enc_count + list(enc_documents)))
-
-    def merge_blocks(self, blocks, final_file):
-        indexes = list()
-
-        # Read all blocks
-        for block_name in blocks:
-            path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '_VBE.txt')
-            index = dict()
-
-            all_nums = []
-            with open(path, "rb") as file:
-                next_num = []
-                for byte in file.read():
-                    next_num.append(byte)
-                    if byte >= 128:
-                        all_nums.append(byte_decode(next_num))
-                        next_num = []
-
-            pointer = 0
-            while pointer < len(all_nums):
-                term_id = all_nums[pointer]
-                count = all_nums[pointer + 1]
-                index[term_id] = {all_nums[p]: all_nums[p+1] for p in range(pointer + 2, pointer + 2 * count + 2, 2)}
-                pointer += 2 * count + 2
-
-            indexes.append(index)
-            os.remove(path)
-
-        # Merge postings list in memory
-        term_ids = set().union(*indexes)
-        global_index = dict()
-        for term_id in term_ids:
-            global_docs = dict()
-            list_docs = [index.get(term_id, {}) for index in indexes]
-            for doc_id in set().union(*list_docs):
-                global_docs[doc_id] = sum(docs.get(doc_id, 0) for docs in list_docs)
-            global_index[term_id] = global_docs
-
-        # Write result to disk
-        self.write_block_to_disk(global_index, final_file)
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + self.suffix)
+        # Entry = doc_id count gap1 freq1 gap2 freq2... where gaps are computed between term_ids
+        nums = ([doc_id, len(terms)] + self.interleave(sorted(terms.items()))
+                for doc_id, terms in sorted(postings.items()))
+        directory = write_compressed_entries(path, self.codec, nums, append=True)
+        self.write_directory_to_disk(directory, file_name + self.suffix, append=True)
+
+    def read_doc_index(self, file_name='doc_index'):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + self.suffix)
+        for nums in read_compressed_entries(path, self.codec):
+            yield nums[0], dict(zip(from_gaps(nums[2::2]), nums[3::2]))
+
+    def read_block(self, block_name, offset=0):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + self.suffix)
+        for nums in read_compressed_entries(path, self.codec, offset):
+            yield nums[0], dict(zip(from_gaps(nums[2::2]), nums[3::2]))
@@ -1,7 +1,7 @@
-import os
-from src.compression.vb_encoding import byte_decode
+from src.compression.vb_encoding import byte_decode, decode_array, from_gaps
+from src.compression.codecs import VariableByte, get_codec
 from src.searching.index_reader import DocIDIndex, FreqIndex
-from config import RES_DIR
+from src.searching.postings import make_postings
 
 
 def get_next_num(data, pointer):
@@ -19,109 +19,73 @@ def skip_next_num(data, pointer):
     return pointer + 1
 
 
+def get_all_nums(data):
+    return decode_array(data).tolist()
+
+
+def get_index_codec(index, codec):
+    """ Codec recorded in the metadata of the index, or the given one for indexes built before it was recorded """
+    return get_codec(index.metadata['codec']) if 'codec' in index.metadata else codec
+
+
+def get_ids(nums, gaps):
+    """ Sorted ids of an entry, from the ids or the gaps written in the index """
+    return from_gaps(nums) if gaps else nums
+
+
 class DocIDIndexVBE(DocIDIndex):
     """
         This class rewrites the methods of DocIDIndex that access and read in index file in order to:
         - redirect the reader to the corresponding folder with compressed indexes
-        - read correctly the compressed reversed index by decoding the bytes
+        - read correctly the compressed reversed index by decoding the bytes with the codec of the index
     """
 
-    def __init__(self, collection):
+    def __init__(self, collection, codec=VariableByte()):
         DocIDIndex.__init__(self, collection)
-        self.index_type = 'IndexVBE_DocID'
+        self.codec = codec
+        self.index_type = 'Index%s_DocID' % codec.suffix
+        self.index_file = 'index_' + codec.suffix
 
     def get_related_documents(self, term_id):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'index_VBE.txt')
-        docs = []
+        data = self.read_postings([term_id]).get(term_id, b'')
+        # Entry = term_id count doc_id1 doc_id2... (or gap1 gap2...)
+        return get_ids(get_index_codec(self, self.codec).decode(data)[2:], self.format_version >= 2)
 
-        with open(path, "rb") as file:
-            data = file.read()
-
-        pointer = 0
-        while pointer < len(data):
-            pointer, num = get_next_num(data, pointer)
-            pointer, count = get_next_num(data, pointer)
-            if num == term_id:
-                for i in range(count):
-                    pointer, doc_id = get_next_num(data, pointer)
-                    docs.append(doc_id)
-                return docs
-            else:
-                for i in range(count):
-                    pointer = skip_next_num(data, pointer)
-
-        return ValueError("term not found ?")
+    def get_related_postings(self, term_id):
+        # Compressed lists stay lists on disk, dense ones become bitmaps in memory
+        return make_postings(self.get_related_documents(term_id), self.stats.nb_documents)
 
 
 class FreqIndexVBE(FreqIndex):
     """
         This class rewrites the methods of FreqIndex that access and read in index file in order to:
         - redirect the reader to the corresponding folder with compressed indexes
-        - read correctly the compressed index and reversed index by decoding the bytes
+        - read correctly the compressed index and reversed index by decoding the bytes with the codec of the index
     """
 
-    def __init__(self, collection):
+    def __init__(self, collection, codec=VariableByte()):
         FreqIndex.__init__(self, collection)
-        self.index_type = 'IndexVBE_Freq'
+        self.codec = codec
+        self.index_type = 'Index%s_Freq' % codec.suffix
+        self.index_file = 'index_' + codec.suffix
+        self.doc_index_file = 'doc_index_' + codec.suffix
 
     def get_related_documents(self, term_ids):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'index_VBE.txt')
         terms_index = {}
 
-        with open(path, "rb") as file:
-            data = file.read()
-
-        pointer = 0
-        while pointer < len(data):
-            pointer, term_id = get_next_num(data, pointer)
-            pointer, count = get_next_num(data, pointer)
-            if term_id in term_ids:
-                postings = {}
-                for i in range(count):
-                    pointer, doc_id = get_next_num(data, pointer)
-                    pointer, freq = get_next_num(data, pointer)
-                    postings[doc_id] = freq
-                terms_index[term_id] = (count, postings)
-            else:
-                for i in range(2 * count):
-                    pointer = skip_next_num(data, pointer)
+        # Entry = term_id count doc_id1 freq1 doc_id2 freq2... (or gap1 freq1 gap2 freq2...)
+        for term_id, data in self.read_postings(term_ids).items():
+            nums = get_index_codec(self, self.codec).decode(data)
+            count = nums[1]
+            postings = dict(zip(get_ids(nums[2::2], self.format_version >= 2), nums[3::2]))
+            terms_index[term_id] = (count, postings)
         return terms_index
 
     def get_related_terms(self, doc_ids):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'doc_index_VBE.txt')
         docs_index = {}
 
-        with open(path, "rb") as file:
-            data = file.read()
-
-        pointer = 0
-        while pointer < len(data):
-            pointer, doc_id = get_next_num(data, pointer)
-            pointer, count = get_next_num(data, pointer)
-            if doc_id in doc_ids:
-                docs_index[doc_id] = {}
-                for i in range(count):
-                    pointer, term_id = get_next_num(data, pointer)
-                    pointer, freq = get_next_num(data, pointer)
-                    docs_index[doc_id][term_id] = freq
-            else:
-                for i in range(2 * count):
-                    pointer = skip_next_num(data, pointer)
+        # Entry = doc_id count term_id1 freq1 term_id2 freq2... (or gap1 freq1 gap2 freq2...)
+        for doc_id, data in self.read_entries(self.doc_index_file, self.doc_directory, doc_ids).items():
+            nums = get_index_codec(self, self.codec).decode(data)
+            docs_index[doc_id] = dict(zip(get_ids(nums[2::2], self.format_version >= 2), nums[3::2]))
         return docs_index
-
-    def get_all_doc_freqs(self):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'index_VBE.txt')
-        doc_freqs = {}
-
-        with open(path, "rb") as file:
-            data = file.read()
-
-        pointer = 0
-        while pointer < len(data):
-            pointer, term_id = get_next_num(data, pointer)
-            pointer, count = get_next_num(data, pointer)
-            doc_freqs[term_id] = count
-            for i in range(2 * count):
-                pointer = skip_next_num(data, pointer)
-
-        return doc_freqs
\ No newline at end of file
@@ -1,4 +1,8 @@
 # This file implements the Variable Byte Encoding method
+# Each number is written in base 128, most significant group first, and the last byte carries the stop bit (+128)
+import itertools
+import numpy as np
+
 
 def byte_encode(id, c=1):
     if id < 128:
@@ -16,6 +20,74 @@ def byte_decode(byte, c=1):
         return 128 * byte_decode(byte[:-1], c=0) + byte[-1] - c * 128
 
 
+# Bulk versions, working on whole posting lists at once with NumPy (same layout as byte_encode / byte_decode)
+def encoded_sizes(nums):
+    """ Number of bytes taken by each number once encoded """
+    sizes = np.ones(len(nums), dtype=np.int64)
+    for k in range(1, 10):
+        sizes += nums >= np.uint64(1 << (7 * k))
+    return sizes
+
+
+def encode_array(nums):
+    """ Encode a sequence of non negative integers and return the bytes """
+    nums = np.asarray(nums, dtype=np.uint64)
+    if len(nums) == 0:
+        return b''
+
+    sizes = encoded_sizes(nums)
+    ends = np.cumsum(sizes)
+
+    out = np.empty(int(ends[-1]), dtype=np.uint8)
+    for k in range(int(sizes.max())):
+        # k-th group of 7 bits starting from the least significant one, for numbers that have it
+        has_group = sizes > k
+        groups = (nums[has_group] >> np.uint64(7 * k)) & np.uint64(127)
+        out[ends[has_group] - 1 - k] = groups.astype(np.uint8)
+    out[ends - 1] |= 128
+    return out.tobytes()
+
+
+def encode_entries(entries):
+    """
+        Encode several sequences of integers (e.g. the entries of an index) in one call.
+        Return the bytes and the number of bytes of each entry
+    """
+    counts = [len(entry) for entry in entries]
+    nums = np.fromiter((num for entry in entries for num in entry), dtype=np.uint64, count=sum(counts))
+    if len(nums) == 0:
+        return b'', [0] * len(entries)
+    sizes = np.concatenate(([0], np.cumsum(encoded_sizes(nums))))
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    return encode_array(nums), (sizes[bounds[1:]] - sizes[bounds[:-1]]).tolist()
+
+
+def decode_array(data):
+    """ Decode a buffer (bytes, bytearray, memoryview) of encoded numbers into a NumPy array of int64 """
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    stops = data >= 128
+    ends = np.flatnonzero(stops)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    # Position of each byte counted from the last byte of its number
+    num_ids = np.concatenate(([0], np.cumsum(stops)[:-1]))
+    shifts = 7 * (ends[num_ids] - np.arange(len(data)))
+    values = (data & 127).astype(np.int64) << shifts.astype(np.int64)
+    return np.add.reduceat(values, starts)
+
+
+# Gaps : sorted ids are stored as the differences between consecutive ids, which are small and take fewer bytes
+def to_gaps(ids):
+    return [ids[0]] + [ids[i] - ids[i - 1] for i in range(1, len(ids))] if len(ids) > 0 else []
+
+
+def from_gaps(gaps):
+    return list(itertools.accumulate(gaps))
+
+
 if __name__ == "__main__":
     # 2.3 Création d'un index inversé compressé
     print("2.3 Creation of Compressed Inversed Index\n")
@@ -29,6 +101,10 @@ if __name__ == "__main__":
         num = byte_decode(b)
         print('test: %i ---encode---> %s ---decode---> %i' % (test, str(b), num))
 
+    print("\n--- Bulk Variable Byte Encoding ---")
+    data = encode_array(tests)
+    print('tests: %s ---encode---> %i bytes ---decode---> %s' % (tests, len(data), decode_array(data).tolist()))
+
     print("\nPour voir cette méthode de compression à l'oeuvre lors de la création des indexes \net lors des "
           "recherches d'information, des sections ont été ajoutés dans :")
     print("- index_builder")
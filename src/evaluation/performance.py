@@ -87,6 +87,7 @@ def perf_searching():
     for q in queries:
         time = timeit(bool.search_for_query, q, index)
         perf_bool.append((sum(map(len, q)), time))
+    index.close()
 
     # Pour une recherche vectorielle
     print("Vectorial search...")
@@ -99,6 +100,7 @@ def perf_searching():
     for q in queries:
         time = timeit(search_query, q, index)
         perf_vect.append((len(q.split()), time))
+    index.close()
 
     return perf_bool, perf_vect
 
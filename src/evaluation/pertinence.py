@@ -77,6 +77,7 @@ class UnrankedResults(Evaluation):
         for q_nb, query in enumerate(self.queries):
             results = bool.search_for_query(query, index)
             all_results[q_nb + 1] = results
+        index.close()
         return all_results
 
 
@@ -104,6 +105,7 @@ class RankedResults(Evaluation):
             query_tokens = Collection(None).process(query)
             results = vect.search_for_query(query_tokens, index, **searchparams)
             all_results[q_nb + 1] = results
+        index.close()
         return all_results
 
     def compute_rp_points(self):
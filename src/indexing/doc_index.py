@@ -1,17 +1,18 @@
-from multiprocessing import Pool
+from array import array
 import itertools
 import operator
 import os
 from config import RES_DIR
 
 from src.indexing.index_builder import BSBI, MapReduce
+from src.searching.postings import BitmapPostings, is_dense
 
 
 class DocBSBI(BSBI, MapReduce):
     """ BSBI algorithm for constructing DocID Indexes with Map Reduce approach, useful for boolean requests """
 
-    def __init__(self, collection):
-        BSBI.__init__(self, collection, 'DocID')
+    def __init__(self, collection, shards=1, partitions=1):
+        BSBI.__init__(self, collection, 'DocID', shards, partitions)
         MapReduce.__init__(self)
 
     # Map Reduce methods
@@ -22,6 +23,7 @@ class DocBSBI(BSBI, MapReduce):
         for term in tokens:
             term_id = self.look_for_term(term)
             pairs.append((term_id, doc_id))
+        self.add_document_stats(doc_id, [term_id for term_id, doc_id in pairs])
         return self.combine(pairs)
 
     def combine(self, pairs):
@@ -33,51 +35,63 @@ class DocBSBI(BSBI, MapReduce):
 
         iter = itertools.groupby(sorted_pairs, operator.itemgetter(0))
         for key, group in iter:
-            values = [item[1] for item in group]
+            values = array('I', [item[1] for item in group])
             all_values.append((key, values))
 
-        pool = Pool()
-        return list(pool.starmap(self.__class__.reduce, all_values))
+        return self.reduce_all(all_values)
 
     @staticmethod
     def reduce(term_id, documents):
-        return term_id, sorted(documents)
+        return term_id, array('I', sorted(documents))
 
     # BSBI methods
+    def construct_index(self):
+        try:
+            BSBI.construct_index(self)
+        finally:
+            self.close_pool()
+
     def parse_block(self, block_name):
         list_pairs = self.collection.process_block(block_name, self.map)
         return set().union(*list_pairs)
 
     def invert_block(self, pairs):
-        postings = dict(self.shuffle_sort(pairs))
+        postings = {term_id: documents.tolist() for term_id, documents in self.shuffle_sort(pairs)}
         return postings
 
-    def write_block_to_disk(self, postings, block_name):
-        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '.txt')
+    def write_postings_to_disk(self, entries, file_name):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '.txt')
+        directory = dict()
+        offset = 0
         with open(path, "w") as file:
-            for term_id, documents in sorted(postings.items()):
-                file.write(' '.join(map(str,[term_id] + documents)) + '\n')
-
-    def merge_blocks(self, blocks, final_file):
-        indexes = list()
-
-        # Read all blocks
-        for block_name in blocks:
-            path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '.txt')
-            index = dict()
-            with open(path, "r") as file:
-                for line in file:
-                    ids = list(map(int, line.split()))
-                    index[ids[0]] = ids[1:]
-            indexes.append(index)
-            os.remove(path)
-
-        # Merge postings list in memory
-        term_ids = set().union(*indexes)
-        global_index = dict()
-        for term_id in term_ids:
-            postings = set().union(*[set(index.get(term_id, [])) for index in indexes])
-            global_index[term_id] = sorted(list(postings))
-
-        # Write result to disk
-        self.write_block_to_disk(global_index, final_file)
+            for term_id, documents in entries:
+                if is_dense(len(documents), len(self.documents)):
+                    # Dense postings list : line = "term_id b<hexadecimal bitmap of doc_ids>"
+                    bitmap = BitmapPostings.from_doc_ids(documents, len(self.documents))
+                    line = '%i b%s\n' % (term_id, bitmap.to_hex())
+                else:
+                    line = ' '.join(map(str,[term_id] + documents)) + '\n'
+                file.write(line)
+                directory[term_id] = (offset, len(line), len(documents))
+                offset += len(line)
+        self.write_directory_to_disk(directory, file_name)
+
+    def read_block(self, block_name, offset=0):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '.txt')
+        with open(path, "r") as file:
+            file.seek(offset)
+            for line in file:
+                ids = line.split()
+                if len(ids) > 1 and ids[1].startswith('b'):
+                    yield int(ids[0]), list(BitmapPostings.from_hex(ids[1][1:], len(self.documents)))
+                else:
+                    yield int(ids[0]), list(map(int, ids[1:]))
+
+    def merge_postings(self, postings_lists):
+        return sorted(set().union(*postings_lists))
+
+    def get_arrays(self, postings):
+        # Dense lists are also written as bitmaps, which readers use as they are instead of building them
+        if is_dense(len(postings), len(self.documents)):
+            return postings, None, BitmapPostings.from_doc_ids(postings, len(self.documents))
+        return postings, None
@@ -1,20 +1,26 @@
-from multiprocessing import Pool
 from collections import defaultdict
-from threading import Thread
+from array import array
 import itertools
 import operator
 import os
+import numpy as np
 from config import RES_DIR
 
-from src.indexing.index_builder import BSBI, MapReduce
+from src.indexing.index_builder import BSBI, MapReduce, ArraysWriter
+from src.searching.mapped_postings import MappedPostings
+import src.searching.weightings as w
 
 
 class FreqBSBI(BSBI, MapReduce):
     """ BSBI algorithm for constructing Frequency Indexes with Map Reduce approach, useful for vectorial requests """
 
-    def __init__(self, collection):
-        BSBI.__init__(self, collection, 'Freq')
+    # Number of postings of the non inversed index weighted at once when computing the norms (bounds their memory)
+    NORMS_CHUNK = 1 << 20
+
+    def __init__(self, collection, shards=1, partitions=1):
+        BSBI.__init__(self, collection, 'Freq', shards, partitions)
         MapReduce.__init__(self)
+        self.forward_file = 'forward'  # non inversed index also written as mapped arrays (ArraysWriter), None if not
 
     # Map Reduce methods
     def map(self, doc_name, tokens):
@@ -24,6 +30,7 @@ class FreqBSBI(BSBI, MapReduce):
         for term in tokens:
             term_id = self.look_for_term(term)
             pairs.append((term_id, doc_id))
+        self.add_document_stats(doc_id, [term_id for term_id, doc_id in pairs])
         return self.combine(pairs)
 
     def combine(self, pairs):
@@ -40,76 +47,217 @@ class FreqBSBI(BSBI, MapReduce):
     def shuffle_sort(self, all_pairs):
         sorted_pairs = sorted(all_pairs)
 
-        # Write current scanned documents index to disk
-        docs_dict = defaultdict(dict)
-        for term, docs in list(all_pairs):
-            docs_dict[docs[0]][term] = len(docs)
-        write_docs = Thread(target=self.add_block_to_disk, args=(docs_dict, 'doc_index'))
-        write_docs.start()
-
         all_values = list()
         iter = itertools.groupby(sorted_pairs, operator.itemgetter(0))
         for key, group in iter:
-            values = itertools.chain(*[item[1] for item in group])
+            values = array('I', itertools.chain(*[item[1] for item in group]))
             all_values.append((key, values))
 
-        write_docs.join()
-        pool = Pool()
-        return list(pool.starmap(self.__class__.reduce, all_values))
+        return self.reduce_all(all_values)
 
     @staticmethod
     def reduce(term_id, documents):
-        doc_dict = dict()
+        # Postings returned as arrays (doc_ids, freqs), cheaper to send back from a worker than a dictionary
+        doc_ids, freqs = array('I'), array('I')
         for doc_id, doc_group in itertools.groupby(documents):
-            doc_dict[doc_id] = len(list(doc_group))
-        return term_id, doc_dict
+            doc_ids.append(doc_id)
+            freqs.append(len(list(doc_group)))
+        return term_id, (doc_ids, freqs)
 
     # BSBI methods
+    def construct_index(self):
+        try:
+            BSBI.construct_index(self)
+            print("computing document norms...")
+            self.write_norms_to_disk('norms', 'bounds')
+        finally:
+            self.close_pool()
+
     def parse_block(self, block_name):
         all_lists_pairs = self.collection.process_block(block_name, self.map)
         return list(itertools.chain(*all_lists_pairs))
 
     def invert_block(self, pairs):
-        postings = dict(self.shuffle_sort(pairs))
+        postings = {term_id: dict(zip(doc_ids, freqs)) for term_id, (doc_ids, freqs) in self.shuffle_sort(pairs)}
         return postings
 
     def write_block_to_disk(self, postings, block_name):
-        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '.txt')
+        BSBI.write_block_to_disk(self, postings, block_name)
+        # Non inversed index of the block, written with the term ids of the block and remapped when merging
+        docs_dict = defaultdict(dict)
+        for term_id, documents in postings.items():
+            for doc_id, freq in documents.items():
+                docs_dict[doc_id][term_id] = freq
+        self.add_block_to_disk(docs_dict, block_name + '_docs')
+
+    def merge_index(self, blocks):
+        BSBI.merge_index(self, blocks)
+        folder = os.path.join(RES_DIR, self.index_type, self.collection.loader.name)
+        forward = ArraysWriter(os.path.join(folder, self.forward_file), 'terms') if self.forward_file else None
+
+        # Blocks hold consecutive doc_ids : their non inversed indexes are appended in order of the blocks
+        for block_name in blocks:
+            remap = self.term_remaps[block_name]
+            docs_dict = {doc_id: {remap[term_id]: freq for term_id, freq in terms.items()}
+                         for doc_id, terms in self.read_doc_index(block_name + '_docs')}
+            self.add_block_to_disk(docs_dict, 'doc_index')
+            if forward is not None:
+                for doc_id, terms in sorted(docs_dict.items()):
+                    term_ids = sorted(terms)
+                    forward.add(doc_id, term_ids, [terms[term_id] for term_id in term_ids])
+            self.remove_files(block_name + '_docs')
+
+        if forward is not None:
+            forward.close()
+
+    def write_postings_to_disk(self, entries, file_name):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '.txt')
+        directory = dict()
+        offset = 0
         with open(path, "w") as file:
-            for term_id, documents in sorted(postings.items()):
+            for term_id, documents in entries:
                 doc_list = ['%i:%i' % (doc_id, freq) for doc_id, freq in sorted(documents.items())]
-                file.write(' '.join([str(term_id)] + [str(len(doc_list))] + doc_list) + '\n')
+                line = ' '.join([str(term_id)] + [str(len(doc_list))] + doc_list) + '\n'
+                file.write(line)
+                directory[term_id] = (offset, len(line), len(doc_list))
+                offset += len(line)
+        self.write_directory_to_disk(directory, file_name)
 
     def add_block_to_disk(self, postings, file_name):
         path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '.txt')
+        # Directory of the documents (line = "doc_id offset length nb_terms"), to read them without scanning the file
+        directory = dict()
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
         with open(path, "a") as file:
             for doc_id, terms in sorted(postings.items()):
                 term_list = ['%i:%i' % (term_id, freq) for term_id, freq in sorted(terms.items())]
-                file.write(' '.join([str(doc_id)] + [str(len(term_list))] + term_list) + '\n')
+                line = ' '.join([str(doc_id)] + [str(len(term_list))] + term_list) + '\n'
+                file.write(line)
+                directory[doc_id] = (offset, len(line), len(term_list))
+                offset += len(line)
+        self.write_directory_to_disk(directory, file_name, append=True)
+
+    def read_block(self, block_name, offset=0):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '.txt')
+        with open(path, "r") as file:
+            file.seek(offset)
+            for line in file:
+                ids = line.split()
+                yield int(ids[0]), {int(doc.split(':')[0]): int(doc.split(':')[1]) for doc in ids[2:]}
 
-    def merge_blocks(self, blocks, final_file):
-        indexes = list()
+    def merge_postings(self, postings_lists):
+        global_docs = dict()
+        for docs in postings_lists:
+            for doc_id, freq in docs.items():
+                global_docs[doc_id] = global_docs.get(doc_id, 0) + freq
+        return global_docs
 
-        # Read all blocks
-        for block_name in blocks:
-            path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + '.txt')
-            index = dict()
-            with open(path, "r") as file:
-                for line in file:
-                    ids = line.split()
-                    index[int(ids[0])] = {int(doc.split(':')[0]): int(doc.split(':')[1]) for doc in ids[2:]}
-            indexes.append(index)
-            os.remove(path)
-
-        # Merge postings list in memory
-        term_ids = set().union(*indexes)
-        global_index = dict()
-        for term_id in term_ids:
-            global_docs = dict()
-            list_docs = [index.get(term_id, {}) for index in indexes]
-            for doc_id in set().union(*list_docs):
-                global_docs[doc_id] = sum(docs.get(doc_id, 0) for docs in list_docs)
-            global_index[term_id] = global_docs
-
-        # Write result to disk
-        self.write_block_to_disk(global_index, final_file)
+    def get_arrays(self, postings):
+        doc_ids = sorted(postings)
+        return doc_ids, [postings[doc_id] for doc_id in doc_ids]
+
+    def read_doc_index(self, file_name='doc_index'):
+        """ Iterate over the non inversed index and yield (doc_id, {term_id: freq, ...}) for each document """
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '.txt')
+        with open(path, "r") as file:
+            for line in file:
+                ids = line.split()
+                yield int(ids[0]), {int(term.split(':')[0]): int(term.split(':')[1]) for term in ids[2:]}
+
+    def read_forward_chunks(self):
+        """
+            Non inversed index in chunks of whole documents holding about NORMS_CHUNK postings, as NumPy arrays
+            (doc_ids, counts, term_ids, freqs) : the counts[i] terms of the document doc_ids[i] follow those of
+            doc_ids[i - 1] in term_ids and freqs. Chunks are slices of the mapped files of the non inversed index
+            when they are written, otherwise they are read in doc_index
+        """
+        if self.forward_file:
+            path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, self.forward_file)
+            forward = MappedPostings(path, 'terms')
+            ends = forward.starts + forward.counts
+            first = 0
+            while first < len(forward.keys):
+                last = int(np.searchsorted(ends, forward.starts[first] + self.NORMS_CHUNK, side='right'))
+                last = max(last, first + 1)
+                start, stop = int(forward.starts[first]), int(ends[last - 1])
+                yield forward.keys[first:last], forward.counts[first:last], forward.ids[start:stop], \
+                    forward.freqs[start:stop]
+                first = last
+            return
+
+        doc_ids, counts, term_ids, freqs = array('q'), array('q'), array('q'), array('q')
+        for doc_id, terms in self.read_doc_index():
+            doc_ids.append(doc_id)
+            counts.append(len(terms))
+            term_ids.extend(terms.keys())
+            freqs.extend(terms.values())
+            if len(term_ids) >= self.NORMS_CHUNK:
+                yield np.array(doc_ids), np.array(counts), np.array(term_ids), np.array(freqs)
+                doc_ids, counts, term_ids, freqs = array('q'), array('q'), array('q'), array('q')
+        if len(doc_ids) > 0:
+            yield np.array(doc_ids), np.array(counts), np.array(term_ids), np.array(freqs)
+
+    def write_norms_to_disk(self, file_name, bounds_file_name):
+        """
+            Precompute for each document the sum (l1) and the sum of squares (l2) of its weights, for every combination
+            of tf and idf functions of the weightings module. File = header line "tf:idf tf:idf ..." followed,
+            for each combination, by the arrays l1[doc_id] and l2[doc_id] (doubles).
+            The same pass gives for each term the highest weight it has in a document normalized by the euclidean norm
+            of this document : an upper bound of its contribution to cosine scores, used by WAND search.
+            Bounds file = same header line followed, for each combination, by the array bound[term_id] (doubles).
+            Documents are weighted with NumPy by chunks of NORMS_CHUNK postings (see read_forward_chunks), whose norms
+            are written at their place in the file : only the bounds of all the terms are kept until the end
+        """
+        nb_docs, nb_terms = len(self.documents), len(self.terms)
+
+        idf_values = dict()
+        for idf in w.IDF_FUNCTIONS:
+            try:
+                idf_values[idf] = np.array([idf(self.doc_freqs[term_id], nb_docs) for term_id in range(nb_terms)],
+                                           dtype=np.float64)
+            except (ValueError, ZeroDivisionError):
+                # Undefined for some terms of this collection : norms will be computed at query time
+                continue
+
+        combinations = [(tf, idf) for tf in w.TF_FUNCTIONS for idf in idf_values]
+        bounds = {comb: np.zeros(nb_terms) for comb in combinations}
+        header = ' '.join('%s:%s' % (tf.__name__, idf.__name__) for tf, idf in combinations) + '\n'
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '.bin')
+        with open(path, "wb") as file:
+            file.write(header.encode())
+            origin = file.tell()
+            file.truncate(origin + 2 * len(combinations) * nb_docs * 8)  # norms of documents without terms stay null
+
+            for doc_ids, counts, term_ids, freqs in self.read_forward_chunks():
+                # Documents without terms are left out (reduceat needs non empty segments)
+                kept = counts > 0
+                doc_ids, counts = doc_ids[kept], counts[kept]
+                if len(doc_ids) == 0:
+                    continue
+                starts = np.cumsum(counts) - counts
+                freqs = freqs.astype(np.float64)
+                totals = np.repeat(np.add.reduceat(freqs, starts), counts)
+                maxima = np.repeat(np.maximum.reduceat(freqs, starts), counts)
+                tf_values = {tf: w.TF_ARRAYS[tf](freqs, totals, maxima) for tf in w.TF_FUNCTIONS}
+
+                # Norms of the range of doc_ids of the chunk, written at the same place in the arrays of the file
+                first, size = int(doc_ids[0]), int(doc_ids[-1]) + 1 - int(doc_ids[0])
+                for number, (tf, idf) in enumerate(combinations):
+                    weights = tf_values[tf] * idf_values[idf][term_ids]
+                    l1, l2 = np.zeros(size), np.zeros(size)
+                    l1[doc_ids - first] = np.add.reduceat(weights, starts)
+                    l2[doc_ids - first] = np.add.reduceat(weights * weights, starts)
+                    file.seek(origin + (2 * number * nb_docs + first) * 8)
+                    l1.tofile(file)
+                    file.seek(origin + ((2 * number + 1) * nb_docs + first) * 8)
+                    l2.tofile(file)
+
+                    norm = np.repeat(np.sqrt(l2[doc_ids - first]), counts)
+                    normalized = norm > 0
+                    np.maximum.at(bounds[tf, idf], term_ids[normalized], weights[normalized] / norm[normalized])
+
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, bounds_file_name + '.bin')
+        with open(path, "wb") as file:
+            file.write(header.encode())
+            for comb in combinations:
+                bounds[comb].tofile(file)
@@ -1,9 +1,57 @@
-from threading import Lock
+from multiprocessing import Pool, Process
+from collections import Counter
+from functools import partial
+from array import array
+import bisect
+import copy
+import heapq
+import itertools
+import operator
+import math
+import struct
+import numpy as np
 import os
-from config import RES_DIR
+from config import RES_DIR, WORKERS
 
 from src.language_processing.processing import Collection
 from src.interface import CACM, CS276
+from src.searching.dictionaries import PostingsDirectory
+
+
+class BlockDictionaries:
+    """
+        Dictionaries of the block being indexed. A block is indexed by only one worker, so no lock is needed :
+        terms get ids private to the block (in order of appearance), that are replaced by global ids once all blocks
+        are indexed, and documents get global ids following the documents of the previous blocks.
+        Document and collection frequencies of the terms are counted with the private ids
+    """
+
+    def __init__(self, doc_offset):
+        self.terms = dict()
+        self.documents = dict()
+        self.doc_offset = doc_offset
+        self.doc_freqs = Counter()
+        self.collection_freqs = Counter()
+
+    def look_for_term(self, term):
+        term_id = self.terms.get(term)
+        if term_id is None:
+            term_id = self.terms[term] = len(self.terms)
+        return term_id
+
+    def look_for_document(self, document):
+        doc_id = self.documents.get(document)
+        if doc_id is None:
+            doc_id = self.documents[document] = self.doc_offset + len(self.documents)
+        return doc_id
+
+    def sort_terms(self):
+        """ Return the terms of the block in lexicographic order, and their ranks in this order by private id """
+        terms = sorted(self.terms)
+        ranks = [0] * len(terms)
+        for rank, term in enumerate(terms):
+            ranks[self.terms[term]] = rank
+        return terms, ranks
 
 
 class IndexBuilder:
@@ -17,26 +65,66 @@ class IndexBuilder:
         self.documents = dict()
         self.terms = dict()
 
-        self.lock_documents = Lock()
-        self.lock_terms = Lock()
+        # Blocks : dictionaries of the block being indexed, terms of each indexed block (in lexicographic order)
+        # and, once all blocks are indexed, arrays giving the global id of each term of a block
+        self.block = None
+        self.block_terms = dict()
+        self.block_documents = dict()  # block name -> range [start, stop) of the doc_ids of the block
+        self.term_remaps = dict()
+
+        # Collection statistics (doc_freqs and collection_freqs are indexed by term until global ids are known)
+        self.doc_lengths = dict()
+        self.max_freqs = dict()
+        self.doc_freqs = Counter()
+        self.collection_freqs = Counter()
+
+        # Description of the format of the index files, written in meta.txt
+        self.metadata = dict()
+
+    def start_block(self):
+        self.block = BlockDictionaries(len(self.documents))
+
+    def end_block(self, block_name):
+        """
+            Gather the dictionaries of the block that has been indexed. The ids of its terms become their ranks
+            in lexicographic order among the terms of the block : return these ranks by private id
+        """
+        terms, ranks = self.block.sort_terms()
+        self.block_terms[block_name] = terms
+        self.block_documents[block_name] = (self.block.doc_offset, self.block.doc_offset + len(self.block.documents))
+        self.documents.update(self.block.documents)
+        for term, term_id in self.block.terms.items():
+            self.doc_freqs[term] += self.block.doc_freqs[term_id]
+            self.collection_freqs[term] += self.block.collection_freqs[term_id]
+        self.block = None
+        return ranks
+
+    def assign_term_ids(self, blocks):
+        """
+            Give the terms their global ids, which are their ranks in lexicographic order, so that they don't depend
+            on the order in which documents were indexed. Ranks in a block and global ids being in the same order,
+            the postings lists of a block stay sorted once their ids are replaced
+        """
+        terms = sorted(set().union(*[self.block_terms[block_name] for block_name in blocks]))
+        self.terms = {term: term_id for term_id, term in enumerate(terms)}
+        for block_name in blocks:
+            self.term_remaps[block_name] = array('q', (self.terms[term] for term in self.block_terms[block_name]))
+        self.doc_freqs = Counter({self.terms[term]: freq for term, freq in self.doc_freqs.items()})
+        self.collection_freqs = Counter({self.terms[term]: freq for term, freq in self.collection_freqs.items()})
 
     def look_for_term(self, term):
-        with self.lock_terms:
-            if term in self.terms:
-                return self.terms[term]
-            else:
-                term_id = len(self.terms)
-                self.terms.update({term: term_id})
-                return term_id
+        return self.block.look_for_term(term)
 
     def look_for_document(self, document):
-        with self.lock_documents:
-            if document in self.documents:
-                return self.documents[document]
-            else:
-                document_id = len(self.documents)
-                self.documents.update({document: document_id})
-                return document_id
+        return self.block.look_for_document(document)
+
+    def add_document_stats(self, doc_id, term_ids):
+        """ Record the length of a document and the frequencies of its terms in the collection statistics """
+        counts = Counter(term_ids)
+        self.doc_lengths[doc_id] = len(term_ids)
+        self.max_freqs[doc_id] = max(counts.values()) if counts else 0
+        self.block.doc_freqs.update(counts.keys())
+        self.block.collection_freqs.update(counts)
 
     def construct_index(self):
         raise NotImplementedError
@@ -45,9 +133,16 @@ class IndexBuilder:
 class BSBI(IndexBuilder):
     """ IndexBuilder that implements the Block Sort-Based Indexing algorithm to construct the indexes """
 
-    def __init__(self, collection, index_type):
+    def __init__(self, collection, index_type, shards=1, partitions=1):
         IndexBuilder.__init__(self, collection)
         self.index_type = 'Index_%s' % index_type
+        self.suffix = ''  # added to the names of the index files (e.g. '_VBE' for compressed indexes)
+        self.arrays_file = 'postings'  # postings also written as mapped arrays (see ArraysWriter), None if not
+        self.shards = shards  # number of ranges of term_ids merged by separate processes (see merge_shards)
+        self.partitions = partitions  # number of groups of documents indexed separately (see merge_partitions)
+        self.block_directories = dict()  # block name -> directory of the block, loaded by the reducer that needs it
+        if shards > 1 and partitions > 1:
+            raise ValueError("an index can't be partitioned both by terms and by documents")
 
     def prepare_folder(self):
         os.makedirs(os.path.join(RES_DIR, self.index_type), exist_ok=True)
@@ -58,20 +153,29 @@ class BSBI(IndexBuilder):
 
     def construct_index(self):
         self.prepare_folder()
-        blocks = self.segment_collection()
+        blocks = self.write_blocks_to_disk()
+        self.assign_term_ids(blocks)
+
+        print("merging blocks...")
+        self.merge_index(blocks)
+        self.write_dict_to_disk(self.documents, 'documents')
+        self.write_dict_to_disk(self.terms, 'terms')
+        self.write_stats_to_disk('stats')
+        self.write_metadata_to_disk('meta')
 
+    def write_blocks_to_disk(self):
+        """ Index the collection block by block, write each block sorted by term_id and return the block names """
+        blocks = self.segment_collection()
         for block_name in blocks:
             print("start processing block :", block_name, '...')
+            self.start_block()
             pairs = self.parse_block(block_name)
             print("having pairs for block :", block_name, '...')
             postings = self.invert_block(pairs)
             print("having postings for block :", block_name, '...')
-            self.write_block_to_disk(postings, block_name)
-
-        print("merging blocks...")
-        self.merge_blocks(blocks, 'index') # Inverted index
-        self.write_dict_to_disk(self.documents, 'documents')
-        self.write_dict_to_disk(self.terms, 'terms')
+            ranks = self.end_block(block_name)
+            self.write_block_to_disk({ranks[term_id]: docs for term_id, docs in postings.items()}, block_name)
+        return blocks
 
     def segment_collection(self):
         return self.collection.loader.blocks
@@ -83,11 +187,174 @@ class BSBI(IndexBuilder):
         raise NotImplementedError
 
     def write_block_to_disk(self, postings, block_name):
+        self.write_postings_to_disk(sorted(postings.items()), block_name)
+
+    def write_postings_to_disk(self, entries, file_name):
+        """ Write the entries (term_id, postings) given in term_id order, one after the other """
+        raise NotImplementedError
+
+    def read_block(self, block_name, offset=0):
+        """ Read one after the other the entries (term_id, postings) of a block from offset, in term_id order """
         raise NotImplementedError
 
-    def merge_blocks(self, blocks, final_file):
+    def merge_postings(self, postings_lists):
+        """ Merge the postings lists of one term coming from several blocks """
         raise NotImplementedError
 
+    def get_arrays(self, postings):
+        """ (doc_ids, freqs) of a postings list, or (doc_ids, freqs, bitmap), as written by ArraysWriter """
+        raise NotImplementedError
+
+    def merge_index(self, blocks):
+        """ Merge the blocks in the inverted index (in shards or partitions if asked), then remove them """
+        if self.partitions > 1:
+            self.merge_partitions(blocks)
+        elif self.shards > 1:
+            self.merge_shards(blocks)
+        else:
+            self.merge_blocks(blocks, 'index', self.arrays_file)
+        for block_name in blocks:
+            self.remove_files(block_name)
+
+    def merge_shards(self, blocks):
+        """
+            Term-partitioned merge : the term_ids are cut into self.shards ranges holding about the same number
+            of postings, and one process per range merges the entries of the blocks in this range into its own shard
+            (index<i> and postings<i>). The ranges and files of the shards are listed in shards.txt
+        """
+        shards = list()
+        for number, (start, stop) in enumerate(self.split_terms(self.shards)):
+            arrays_file = '%s%i' % (self.arrays_file, number) if self.arrays_file else None
+            shards.append((start, stop, 'index%i' % number, arrays_file))
+
+        self.run_reducers([(blocks, index_file, arrays_file, start, stop)
+                           for start, stop, index_file, arrays_file in shards])
+        self.write_parts_to_disk(shards, 'shards')
+        self.metadata['shards'] = len(shards)
+
+    def merge_partitions(self, blocks):
+        """
+            Document-partitioned merge : the blocks are cut into self.partitions groups of consecutive blocks
+            (e.g. one per directory of CS276), and one process per group merges its blocks into the inverted index
+            of its documents (part<i>_index and part<i>_postings). The ranges of doc_ids and the files of the partitions
+            are listed in partitions.txt. Dictionaries, statistics, norms and the non inversed index stay global,
+            so that the partitions can be searched separately with the scores of the whole collection
+        """
+        partitions = list()
+        for number, group in enumerate(np.array_split(np.arange(len(blocks)), min(self.partitions, len(blocks)))):
+            group = [blocks[position] for position in group]
+            start, stop = self.block_documents[group[0]][0], self.block_documents[group[-1]][1]
+            arrays_file = 'part%i_%s' % (number, self.arrays_file) if self.arrays_file else None
+            partitions.append((group, start, stop, 'part%i_index' % number, arrays_file))
+
+        self.run_reducers([(group, index_file, arrays_file) for group, _, _, index_file, arrays_file in partitions])
+        self.write_parts_to_disk([partition[1:] for partition in partitions], 'partitions')
+        self.metadata['partitions'] = len(partitions)
+
+    def run_reducers(self, merges):
+        """
+            Run each merge (arguments of merge_blocks) in its own process and wait for all of them. The processes
+            get a copy of the builder without what their merge doesn't read (see reducer), which is pickled when
+            processes are started with spawn (default start method on macOS and Windows), for shards as for partitions
+        """
+        reducers = [Process(target=self.reducer(args[0]).merge_blocks, args=args) for args in merges]
+        for reducer in reducers:
+            reducer.start()
+        for reducer in reducers:
+            reducer.join()
+        failed = [args[1] for reducer, args in zip(reducers, merges) if reducer.exitcode != 0]
+        if failed:
+            raise RuntimeError("merge of %s failed" % ', '.join(failed))
+
+    def reducer(self, blocks):
+        """
+            Copy of this builder for a process merging blocks : without the dictionary of terms and the statistics,
+            and with the remaps of these blocks only (e.g. one group of blocks for a document partition)
+        """
+        reducer = copy.copy(self)
+        reducer.term_remaps = {block_name: self.term_remaps[block_name] for block_name in blocks}
+        reducer.block_documents = {block_name: self.block_documents[block_name] for block_name in blocks}
+        reducer.terms = dict()
+        reducer.block = None
+        reducer.block_terms = dict()
+        reducer.block_directories = dict()
+        reducer.doc_lengths = dict()
+        reducer.max_freqs = dict()
+        reducer.doc_freqs = Counter()
+        reducer.collection_freqs = Counter()
+        return reducer
+
+    def split_terms(self, nb_ranges):
+        """ Cut the term_ids in at most nb_ranges ranges [start, stop) of consecutive ids with as many postings """
+        nb_terms = len(self.terms)
+        postings = np.cumsum([self.doc_freqs[term_id] for term_id in range(nb_terms)], dtype='int64')
+        total = int(postings[-1]) if nb_terms > 0 else 0
+        bounds = [int(np.searchsorted(postings, total * number / nb_ranges)) for number in range(1, nb_ranges)]
+        # Equal bounds (fewer terms than ranges, or terms with many postings) would give empty ranges : they are
+        # dropped, so there are at most nb_terms ranges (one empty range for an empty collection)
+        bounds = sorted(set([0, nb_terms] + bounds)) if nb_terms > 0 else [0, 0]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def merge_blocks(self, blocks, final_file, arrays_file=None, start=0, stop=None):
+        """
+            External k-way merge : the blocks, sorted by term_id, are read entry by entry and a heap on term_id
+            gives the next entries to merge. Merged postings lists are written as soon as they are complete, so that
+            only one entry per block is kept in memory. Only the term_ids in [start, stop) are merged
+        """
+        folder = os.path.join(RES_DIR, self.index_type, self.collection.loader.name)
+        blocks_entries = [self.read_remapped_block(block_name, start, stop) for block_name in blocks]
+        entries = heapq.merge(*blocks_entries, key=operator.itemgetter(0))
+        arrays = ArraysWriter(os.path.join(folder, arrays_file)) if arrays_file else None
+
+        def merged_entries():
+            for term_id, group in itertools.groupby(entries, key=operator.itemgetter(0)):
+                postings = self.merge_postings([postings for _, postings in group])
+                if arrays is not None:
+                    arrays.add(term_id, *self.get_arrays(postings))
+                yield term_id, postings
+
+        self.write_postings_to_disk(merged_entries(), final_file)
+        if arrays is not None:
+            arrays.close()
+
+    def read_remapped_block(self, block_name, start=0, stop=None):
+        """
+            Entries of a block with the global ids of the terms, only for the global ids in [start, stop).
+            Global ids being in the same order as the ids of the block, these entries are consecutive in the block
+        """
+        remap = self.term_remaps[block_name]
+        first = bisect.bisect_left(remap, start)
+        last = bisect.bisect_left(remap, stop) if stop is not None else len(remap)
+        if first >= last:
+            return
+        # Entries are in the order of the ids of the block, the first one at the beginning of the file
+        offset = self.block_directory(block_name).get(first)[0] if first > 0 else 0
+        for term_id, postings in self.read_block(block_name, offset):
+            if term_id >= last:
+                return
+            yield remap[term_id], postings
+
+    def block_directory(self, block_name):
+        """ Offsets of the entries of a block by id of the block, read in its directory on first use """
+        if block_name not in self.block_directories:
+            path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, block_name + self.suffix)
+            self.block_directories[block_name] = PostingsDirectory(path + '_dir.txt')
+        return self.block_directories[block_name]
+
+    def remove_files(self, file_name):
+        """ Remove a temporary index file and its directory """
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + self.suffix)
+        for extension in ['.txt', '_dir.txt']:
+            if os.path.exists(path + extension):
+                os.remove(path + extension)
+
+    def write_directory_to_disk(self, directory, file_name, append=False):
+        """ Write the position of each postings list in the index file : line = "term_id offset length doc_freq" """
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '_dir.txt')
+        with open(path, "a" if append else "w") as file:
+            for term_id, (offset, length, doc_freq) in sorted(directory.items()):
+                file.write('%i %i %i %i\n' % (term_id, offset, length, doc_freq))
+
     def write_dict_to_disk(self, dictionary, file_name):
         path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '.txt')
         with open(path, "w") as file:
@@ -95,8 +362,103 @@ class BSBI(IndexBuilder):
                 file.write('%s %i\n' % (ref, id))
 
 
+    def write_parts_to_disk(self, parts, file_name):
+        """
+            Manifest of the shards (ranges of term_ids) or partitions (ranges of doc_ids) of the index :
+            line = "start stop index_file [arrays_file]"
+        """
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '.txt')
+        with open(path, "w") as file:
+            for start, stop, index_file, arrays_file in parts:
+                files = [index_file + self.suffix] + ([arrays_file] if arrays_file else [])
+                file.write(' '.join(['%i %i' % (start, stop)] + files) + '\n')
+
+    def write_metadata_to_disk(self, file_name):
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '.txt')
+        with open(path, "w") as file:
+            for key, value in sorted(self.metadata.items()):
+                file.write('%s %s\n' % (key, value))
+
+    def write_stats_to_disk(self, file_name):
+        """
+            Write collection statistics in binary (native byte order) : header (nb_docs, nb_terms) followed by the arrays
+            doc_freqs[term_id], collection_freqs[term_id], doc_lengths[doc_id] and max_freqs[doc_id]
+        """
+        path = os.path.join(RES_DIR, self.index_type, self.collection.loader.name, file_name + '.bin')
+        nb_docs, nb_terms = len(self.documents), len(self.terms)
+        with open(path, "wb") as file:
+            file.write(struct.pack('=II', nb_docs, nb_terms))
+            array('I', (self.doc_freqs[term_id] for term_id in range(nb_terms))).tofile(file)
+            array('Q', (self.collection_freqs[term_id] for term_id in range(nb_terms))).tofile(file)
+            array('I', (self.doc_lengths.get(doc_id, 0) for doc_id in range(nb_docs))).tofile(file)
+            array('I', (self.max_freqs.get(doc_id, 0) for doc_id in range(nb_docs))).tofile(file)
+
+
+class ArraysWriter:
+    """
+        Write postings lists one after the other as fixed-width little-endian arrays, that readers map in memory
+        without parsing (see src.searching.mapped_postings) : <path>_docs.bin (uint32 doc_ids), <path>_freqs.bin
+        (uint32 freqs, only if they are given) and <path>_dir.bin (int64 rows "term_id start count").
+        Lists given as bitmaps too (dense lists of DocID indexes) are also written in <path>_bitmaps.bin, one
+        fixed-width BitmapPostings after the other, their term_ids being listed in <path>_dense.bin (int64).
+        The forward index is written the same way, with lists of term_ids by doc_id in <path>_terms.bin
+    """
+
+    def __init__(self, path, ids_name='docs'):
+        self.path = path
+        self.docs_file = open('%s_%s.bin' % (path, ids_name), 'wb')
+        self.dir_file = open(path + '_dir.bin', 'wb')
+        self.freqs_file = None
+        self.dense_file = None
+        self.bitmaps_file = None
+        self.position = 0
+
+    def add(self, term_id, doc_ids, freqs=None, bitmap=None):
+        self.dir_file.write(np.array([term_id, self.position, len(doc_ids)], dtype='<i8').tobytes())
+        self.docs_file.write(np.array(doc_ids, dtype='<u4').tobytes())
+        if freqs is not None:
+            if self.freqs_file is None:
+                self.freqs_file = open(self.path + '_freqs.bin', 'wb')
+            self.freqs_file.write(np.array(freqs, dtype='<u4').tobytes())
+        if bitmap is not None:
+            if self.bitmaps_file is None:
+                self.dense_file = open(self.path + '_dense.bin', 'wb')
+                self.bitmaps_file = open(self.path + '_bitmaps.bin', 'wb')
+            self.dense_file.write(np.array([term_id], dtype='<i8').tobytes())
+            self.bitmaps_file.write(bitmap.bytes)
+        self.position += len(doc_ids)
+
+    def close(self):
+        for file in [self.docs_file, self.dir_file, self.freqs_file, self.dense_file, self.bitmaps_file]:
+            if file is not None:
+                file.close()
+
+
+def reduce_range(reduce, items):
+    """ Reduce, in a worker, a range of consecutive keys : items = [(key, values), ...] sorted by key """
+    return [reduce(key, values) for key, values in items]
+
+
 class MapReduce:
-    """ Map Reduce steps that must be implemented in classes that inherit MapReduce """
+    """
+        Map Reduce steps that must be implemented in classes that inherit MapReduce.
+        The reduce step runs in a pool of processes opened at the first reduction and kept until close_pool() :
+        the keys are split into ranges of at least MIN_RANGE consecutive keys (a few ranges per worker),
+        each worker reducing a whole range, so that a task is worth the cost of sending it to another process
+    """
+
+    # Minimum number of keys in a range sent to a worker, smaller reductions are done in the current process
+    MIN_RANGE = 1024
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.pool = None
+
+    def __getstate__(self):
+        # The pool stays in the process that opened it
+        state = dict(self.__dict__)
+        state['pool'] = None
+        return state
 
     def map(self, key, value):
         raise NotImplementedError
@@ -111,6 +473,24 @@ class MapReduce:
     def reduce(key, values):
         raise NotImplementedError
 
+    def reduce_all(self, all_values):
+        """ Reduce all the values [(key, values), ...] sorted by key, return the results in the same order """
+        size = max(self.MIN_RANGE, math.ceil(len(all_values) / (4 * self.workers)))
+        ranges = [all_values[start:start + size] for start in range(0, len(all_values), size)]
+        if len(ranges) <= 1 or self.workers <= 1:
+            return reduce_range(self.__class__.reduce, all_values)
+
+        if self.pool is None:
+            self.pool = Pool(self.workers)
+        results = self.pool.map(partial(reduce_range, self.__class__.reduce), ranges)
+        return list(itertools.chain.from_iterable(results))
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
 
 if __name__ == '__main__':
     # 2.2 Indexation
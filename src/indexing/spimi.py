@@ -0,0 +1,101 @@
+from collections import Counter
+
+from src.indexing.doc_index import DocBSBI
+from src.indexing.freq_index import FreqBSBI
+
+# Default memory budget of a run (bytes)
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+
+class SPIMI:
+    """
+        Single-Pass In-Memory Indexing : each document is added straight into the postings lists of the current run
+        (dict term_id -> postings), without lists of (term_id, doc_id) pairs to sort. When the estimated size of
+        the run reaches memory_budget, the run is written to disk sorted by term_id and a new one is started.
+        Runs are then merged like BSBI blocks, so the peak memory depends on the budget instead of the size
+        of the blocks of the loader. Each run has its own dictionaries (see BlockDictionaries), like a BSBI block
+    """
+
+    # Estimated size in memory of one posting, and of one postings list without its postings (bytes)
+    POSTING_SIZE = 40
+    TERM_SIZE = 200
+
+    def __init__(self, memory_budget=MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.run = dict()
+        self.run_size = 0
+        self.runs = list()
+
+    def write_blocks_to_disk(self):
+        self.start_block()
+        for block_name in self.segment_collection():
+            print("start processing block :", block_name, '...')
+            self.collection.process_block(block_name, self.add_document)
+        self.flush_run()
+        return self.runs
+
+    def add_document(self, doc_name, tokens):
+        doc_id = self.look_for_document(doc_name)
+        term_ids = [self.look_for_term(term) for term in tokens]
+        self.add_document_stats(doc_id, term_ids)
+        self.add_to_run(doc_id, Counter(term_ids))
+        if self.run_size >= self.memory_budget:
+            self.flush_run()
+
+    def add_to_run(self, doc_id, counts):
+        """ Add the terms {term_id: freq} of a document to the postings lists of the run and update run_size """
+        raise NotImplementedError
+
+    def flush_run(self):
+        """ Write the current run to disk (if it has documents) and start a new one """
+        if len(self.block.documents) > 0:
+            run_name = 'run%i' % len(self.runs)
+            print("writing run :", run_name, '...')
+            ranks = self.end_block(run_name)
+            self.run = {ranks[term_id]: postings for term_id, postings in self.run.items()}
+            self.write_run_to_disk(run_name)
+            self.runs.append(run_name)
+            self.start_block()
+        self.run = dict()
+        self.run_size = 0
+
+    def write_run_to_disk(self, run_name):
+        self.write_block_to_disk(self.run, run_name)
+
+
+class DocSPIMI(SPIMI, DocBSBI):
+    """ SPIMI algorithm for constructing DocID Indexes, the runs are merged and written like in DocBSBI """
+
+    def __init__(self, collection, memory_budget=MEMORY_BUDGET, shards=1, partitions=1):
+        DocBSBI.__init__(self, collection, shards, partitions)
+        SPIMI.__init__(self, memory_budget)
+
+    def add_to_run(self, doc_id, counts):
+        for term_id in counts:
+            if term_id not in self.run:
+                self.run[term_id] = list()
+                self.run_size += self.TERM_SIZE
+            self.run[term_id].append(doc_id)
+        self.run_size += self.POSTING_SIZE * len(counts)
+
+    def write_run_to_disk(self, run_name):
+        # A document met twice keeps its first id, so ids may not come in increasing order
+        for documents in self.run.values():
+            documents.sort()
+        SPIMI.write_run_to_disk(self, run_name)
+
+
+class FreqSPIMI(SPIMI, FreqBSBI):
+    """ SPIMI algorithm for constructing Frequency Indexes, the runs are merged and written like in FreqBSBI """
+
+    def __init__(self, collection, memory_budget=MEMORY_BUDGET, shards=1, partitions=1):
+        FreqBSBI.__init__(self, collection, shards, partitions)
+        SPIMI.__init__(self, memory_budget)
+
+    def add_to_run(self, doc_id, counts):
+        for term_id, freq in counts.items():
+            if term_id not in self.run:
+                self.run[term_id] = dict()
+                self.run_size += self.TERM_SIZE
+            self.run[term_id][doc_id] = freq
+        self.run_size += 2 * self.POSTING_SIZE * len(counts)
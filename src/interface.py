@@ -1,8 +1,10 @@
 import os
 import math
-from threading import Thread
+from threading import Thread, BoundedSemaphore, Lock
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 from collections import defaultdict
-from config import DATA_DIR
+from config import DATA_DIR, WORKERS, BATCH_SIZE, EXECUTOR
 
 def load_stop_words():
 	""" Read and return the list of stop-words that is given in CACM data.
@@ -29,13 +31,88 @@ def read_relevance_judgments():
 	return judgments
 
 
+def keep(content):
+	return content
+
+
+def work_on_batch(work, batch):
+	return [(doc_name, work(content)) for doc_name, content in batch]
+
+
+class DocumentPool:
+	"""
+		Bounded pool of workers (threads or processes) that documents are sent to by batches.
+		work(content) is executed by the workers, then callback(doc_name, result) is called for each document
+		of the batch (in the parent process, so work must be picklable for process workers).
+		Results are delivered in the order documents were submitted, whatever the order in which workers finish,
+		so that ids given in callbacks don't depend on scheduling.
+		When 2 * workers batches are waiting, submit() blocks : the loader stops reading files until workers catch up.
+		join() waits for all documents, like Thread.join() for the threads that were used before
+	"""
+
+	def __init__(self, callback, work=keep, workers=WORKERS, batch_size=BATCH_SIZE, executor=EXECUTOR):
+		if executor not in ['thread', 'process']:
+			raise ValueError("unknown executor '%s', expected 'thread' or 'process'" % executor)
+		self.callback = callback
+		self.work = work
+		self.batch_size = batch_size
+		self.batch = list()
+		self.pending = BoundedSemaphore(2 * workers)
+		self.errors = list()
+		self.nb_submitted = 0
+		self.nb_delivered = 0
+		self.finished = dict()  # batches finished before the previous ones : number -> future
+		self.lock_delivery = Lock()
+		self.executor = ThreadPoolExecutor(workers) if executor == 'thread' else ProcessPoolExecutor(workers)
+
+	def submit(self, doc_name, content):
+		self.batch.append((doc_name, content))
+		if len(self.batch) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		if self.batch:
+			self.pending.acquire()
+			future = self.executor.submit(work_on_batch, self.work, self.batch)
+			future.add_done_callback(partial(self.finish, self.nb_submitted))
+			self.nb_submitted += 1
+			self.batch = list()
+
+	def finish(self, number, future):
+		with self.lock_delivery:
+			self.finished[number] = future
+			while self.nb_delivered in self.finished:
+				self.deliver(self.finished.pop(self.nb_delivered))
+				self.nb_delivered += 1
+
+	def deliver(self, future):
+		try:
+			for doc_name, result in future.result():
+				self.callback(doc_name, result)
+		except BaseException as error:
+			self.errors.append(error)
+		finally:
+			self.pending.release()
+
+	def join(self):
+		self.flush()
+		self.executor.shutdown(wait=True)
+		if self.errors:
+			raise self.errors[0]
+
+
 class CollectionLoader:
 	""" This abstract class represents a brute collection and should propose different ways to load it """
 
-	def __init__(self, name):
+	def __init__(self, name, workers=WORKERS, batch_size=BATCH_SIZE, executor=EXECUTOR):
 		self._name = name
 		self._blocks = []
 
+		# Options of the pool of workers processing the documents
+		self.workers = workers
+		self.batch_size = batch_size
+		self.executor = executor
+
 	@property
 	def name(self):
 		return self._name
@@ -56,29 +133,28 @@ class CollectionLoader:
 	def load_block(self, name, callback):
 		raise NotImplementedError
 
+	def create_pool(self, callback, work=keep):
+		return DocumentPool(callback, work, self.workers, self.batch_size, self.executor)
+
 
 class CACM(CollectionLoader):
 	""" Implementation of CollectionLoader for CACM collection """
 
-	def __init__(self):
-		CollectionLoader.__init__(self, 'CACM')
+	def __init__(self, **options):
+		CollectionLoader.__init__(self, 'CACM', **options)
 		self.markers = ['.I', '.T', '.W', '.B', '.A', '.N', '.X', '.K', '.C']
 		self._blocks = ['all']
 
-	def load_all_documents(self, callback, percentage=1.0, grouped=True):
+	def load_all_documents(self, callback, percentage=1.0, grouped=True, work=keep):
 		"""
 			The documents will be picked regularly in the all collection for a better representativeness.
 			For example, when we ask for half of the collection, we will pick one document out of 2 (the even ones)
+			If not grouped, documents are sent one by one to a pool of workers (see DocumentPool)
 		"""
 		path = os.path.join(DATA_DIR, self.name, 'cacm.all')
 		mod = 1/percentage  # We take one document out of mod (out of 2 if percentage is 50%)
 		content = ""
-		threads = list()
-
-		def sender(doc_id, content):
-			thread = Thread(target=callback, args=(doc_id, content))
-			thread.start()
-			threads.append(thread)
+		pool = self.create_pool(callback, work) if not grouped else None
 
 		with open(path, 'r') as f:
 			doc_id = 0
@@ -93,65 +169,74 @@ class CACM(CollectionLoader):
 
 				if line.startswith('.I'):
 					if not grouped and content:
-						sender(doc_id, content)
+						pool.submit(doc_id, content)
 						content = ""
 					doc_id = int(line[3:])
 				elif line[:2] in ['.T', '.W', '.K'] and math.floor(doc_id % mod) == 0:
 					take_line = True
 
 			if not grouped and content:
-				sender(doc_id, content)
+				pool.submit(doc_id, content)
 
 		if not grouped:
-			return threads
+			return [pool]
 		thread = Thread(target=callback, args=(content, ))
 		thread.start()
 		return [thread]
 
-	def load_block(self, name, callback):
+	def load_block(self, name, callback, work=keep):
 		if name == 'all':
-			return self.load_all_documents(callback, grouped=False)
+			return self.load_all_documents(callback, grouped=False, work=work)
 
 
 class CS276(CollectionLoader):
 	""" Implementation of CollectionLoader for CS276 collection """
 
-	def __init__(self):
-		CollectionLoader.__init__(self, 'CS276')
+	def __init__(self, **options):
+		CollectionLoader.__init__(self, 'CS276', **options)
 		self._blocks = [str(nb) for nb in range(10)]
 
-	def load_all_documents(self, callback, percentage=1.0):
+	def load_all_documents(self, callback, percentage=1.0, grouped=True, work=keep):
 		"""
 			Directories will not be separated when considering only a portion of the collection.
 			The percentage will be used to determine how many directories of the collection we should read
+			If not grouped, the documents of all these directories are sent one by one to the same pool of workers
 		"""
 		nb_dir = round(percentage * 10)
-		threads = list()
+		if not grouped:
+			pool = self.create_pool(callback, work)
+			for nb in range(nb_dir):
+				self.send_block(str(nb), pool)
+			return [pool]
 
+		threads = list()
 		for nb in range(nb_dir):
 			thread = self.load_block(str(nb), callback, grouped=True)
 			threads.append(thread)
 
 		return threads
 
-	def load_block(self, name, callback, grouped=False):
-		content = ""
-		threads = list()
+	def load_block(self, name, callback, grouped=False, work=keep):
+		if not grouped:
+			pool = self.create_pool(callback, work)
+			self.send_block(name, pool)
+			return [pool]
 
+		content = ""
 		path_dir = os.path.join(DATA_DIR, self.name, name)
-		for file in os.listdir(path_dir):
+		for file in sorted(os.listdir(path_dir)):
 			if not file.startswith('.'):
 				with open(os.path.join(path_dir, file), 'r') as f:
-					if grouped:
-						content += f.read()
-					else:
-						doc_name = '%s_%s' % (name, file)
-						thread = Thread(target=callback, args=(doc_name, f.read()))
-						thread.start()
-						threads.append(thread)
+					content += f.read()
 
-		if not grouped:
-			return threads
 		thread = Thread(target=callback, args=(content,))
 		thread.start()
 		return thread
+
+	def send_block(self, name, pool):
+		""" Send the documents of a directory one by one to the pool, in the order of their file names """
+		path_dir = os.path.join(DATA_DIR, self.name, name)
+		for file in sorted(os.listdir(path_dir)):
+			if not file.startswith('.'):
+				with open(os.path.join(path_dir, file), 'r') as f:
+					pool.submit('%s_%s' % (name, file), f.read())
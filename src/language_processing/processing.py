@@ -1,5 +1,6 @@
 import re
 from collections import Counter
+from functools import partial
 import math
 import matplotlib.pyplot as plt
 from threading import Lock
@@ -29,6 +30,17 @@ class Collection:
 		self.tokens_lock = Lock()
 		self.dist_lock = Lock()
 
+	def __getstate__(self):
+		# Locks can't be pickled (e.g. for processes started with spawn), the copy gets its own ones
+		state = dict(self.__dict__)
+		del state['tokens_lock'], state['dist_lock']
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.tokens_lock = Lock()
+		self.dist_lock = Lock()
+
 	@staticmethod
 	def tokenize(text, strong):
 		if strong:
@@ -46,13 +58,12 @@ class Collection:
 		return [stemmer.stem(word) for word in tokens]
 
 	def process(self, text):
-		tokens = self.tokenize(text, strong=self.do_tokenize)
-		if self.do_filter:
-			tokens = self.filter(tokens)
-		if self.do_normalize:
-			tokens = self.normalize(tokens)
+		return process_text(text, self.do_tokenize, self.do_filter, self.do_normalize)
 
-		return tokens
+	@property
+	def processor(self):
+		""" Picklable equivalent of self.process, that can be executed by the workers of the loader """
+		return partial(process_text, tokn=self.do_tokenize, filt=self.do_filter, norm=self.do_normalize)
 
 	def compute_distrib(self, tokens):
 		with self.tokens_lock:
@@ -61,31 +72,59 @@ class Collection:
 			with self.dist_lock:
 				self.freq_dist[word] += 1
 
+	def add_distrib(self, counts):
+		""" Same as compute_distrib, for tokens already counted {token: count} """
+		with self.tokens_lock:
+			self.tokens_number += sum(counts.values())
+		with self.dist_lock:
+			self.freq_dist.update(counts)
+
+	@property
+	def counter(self):
+		""" Picklable function counting the processed tokens of a text, executed by the workers of the loader """
+		return partial(count_tokens, tokn=self.do_tokenize, filt=self.do_filter, norm=self.do_normalize)
+
 	def process_collection(self, percentage=1.0):
-		""" Process all collection (or a percentage of it) and compute stats (distributions, size of vocabulary...) """
+		"""
+			Process all collection (or a percentage of it) and compute stats (distributions, size of vocabulary...)
+			Documents are processed by batches in the pool of workers of the loader, which only send back
+			the counts of the tokens of each document
+		"""
 
-		def process_contents(content):
-			tokens = self.process(content)
-			self.compute_distrib(tokens)
+		def add_counts(doc_name, counts):
+			self.add_distrib(counts)
 
-		threads = self.loader.load_all_documents(process_contents, percentage)
-		[thread.join() for thread in threads]
+		pools = self.loader.load_all_documents(add_counts, percentage, grouped=False, work=self.counter)
+		[pool.join() for pool in pools]
 
 	def process_block(self, block_name, callback):
-		""" Load only one block and process documents one by one in threads as soon as they are loaded """
+		""" Load only one block and process documents by batches in the pool of workers as soon as they are loaded """
 		list_pairs = list()
 		lock = Lock()
 
-		def process_document(doc_name, content):
-			tokens = self.process(content)
+		def process_document(doc_name, tokens):
 			with lock:
 				list_pairs.append(callback(doc_name, tokens))
 
-		threads = self.loader.load_block(block_name, process_document)
-		[thread.join() for thread in threads]
+		pools = self.loader.load_block(block_name, process_document, work=self.processor)
+		[pool.join() for pool in pools]
 		return list_pairs
 
 
+def process_text(text, tokn=True, filt=True, norm=False):
+	tokens = Collection.tokenize(text, strong=tokn)
+	if filt:
+		tokens = Collection.filter(tokens)
+	if norm:
+		tokens = Collection.normalize(tokens)
+
+	return tokens
+
+
+def count_tokens(text, tokn=True, filt=True, norm=False):
+	return Counter(process_text(text, tokn, filt, norm))
+
+
 if __name__ == '__main__':
 	# 2.1 : Traitements linguistiques
 	print("2.1 Language processing\n")
@@ -0,0 +1,234 @@
+import re
+import itertools
+from src.searching.postings import BitmapPostings
+
+
+class QuerySyntaxError(Exception): pass
+
+
+# Parsing : general boolean expressions are turned into trees ('and', [...]), ('or', [...]), ('not', x), ('term', t)
+# Grammar :  expr := and_expr (OR and_expr)*
+#            and_expr := not_expr ([AND] not_expr)*       (AND is implicit between two operands)
+#            not_expr := NOT not_expr | -term | ( expr ) | term
+def tokenize_query(text):
+    return re.findall(r"\(|\)|[^\s()]+", text)
+
+
+def parse_query(text):
+    """ Parse a boolean expression like 'operating (system OR -kernel) NOT ibm' into a tree """
+    tokens = tokenize_query(text)
+    if len(tokens) == 0:
+        raise QuerySyntaxError("empty query")
+    tree, position = parse_or(tokens, 0)
+    if position < len(tokens):
+        raise QuerySyntaxError("unexpected '%s'" % tokens[position])
+    return tree
+
+
+def parse_or(tokens, position):
+    operands = list()
+    operand, position = parse_and(tokens, position)
+    operands.append(operand)
+    while position < len(tokens) and tokens[position] == 'OR':
+        operand, position = parse_and(tokens, position + 1)
+        operands.append(operand)
+    return (operands[0], position) if len(operands) == 1 else (('or', operands), position)
+
+
+def parse_and(tokens, position):
+    operands = list()
+    operand, position = parse_not(tokens, position)
+    operands.append(operand)
+    while position < len(tokens) and tokens[position] not in ['OR', ')']:
+        if tokens[position] == 'AND':
+            position += 1
+        operand, position = parse_not(tokens, position)
+        operands.append(operand)
+    return (operands[0], position) if len(operands) == 1 else (('and', operands), position)
+
+
+def parse_not(tokens, position):
+    if position >= len(tokens):
+        raise QuerySyntaxError("missing operand at the end of the query")
+    token = tokens[position]
+    if token == 'NOT':
+        operand, position = parse_not(tokens, position + 1)
+        return ('not', operand), position
+    if token == '(':
+        operand, position = parse_or(tokens, position + 1)
+        if position >= len(tokens) or tokens[position] != ')':
+            raise QuerySyntaxError("missing ')'")
+        return operand, position + 1
+    if token in ['AND', 'OR', ')']:
+        raise QuerySyntaxError("unexpected '%s'" % token)
+    if token.startswith('-') and len(token) > 1:
+        return ('not', ('term', token[1:].lower())), position + 1
+    return ('term', token.lower()), position + 1
+
+
+# Evaluation : trees are compiled into cursors that stream doc_ids in increasing order, and can jump forward
+class Cursor:
+    """ Lazy iterator over sorted doc_ids : doc is the current doc_id (None once exhausted) """
+
+    def advance(self, target):
+        """ Move to the first doc_id >= target and return it """
+        raise NotImplementedError
+
+
+class TermCursor(Cursor):
+    """ Postings list with skip pointers, galloped through from the current position """
+
+    def __init__(self, postings):
+        self.postings = postings
+        self.position = 0
+        self.doc = postings[0] if len(postings) > 0 else None
+
+    def advance(self, target):
+        if self.doc is not None and self.doc < target:
+            self.position = self.postings.advance(self.position, target)
+            self.doc = self.postings[self.position] if self.position < len(self.postings) else None
+        return self.doc
+
+
+class BitmapCursor(Cursor):
+    """ Bitmap of a dense term, read in place : the next doc_id is its next set bit, searched in its bytes """
+
+    NON_ZERO = re.compile(b'[^\x00]')
+
+    def __init__(self, postings):
+        self.data = postings.bytes
+        self.doc = self.find(0)
+
+    def find(self, target):
+        """ First doc_id >= target of the bitmap, None if there is none """
+        position = target >> 3
+        if position >= len(self.data):
+            return None
+        byte = self.data[position] >> (target & 7)
+        if byte:
+            return target + (byte & -byte).bit_length() - 1
+        # First non null byte after the one of target (searched in C by the regular expression)
+        match = self.NON_ZERO.search(self.data, position + 1)
+        if match is None:
+            return None
+        byte = self.data[match.start()]
+        return 8 * match.start() + (byte & -byte).bit_length() - 1
+
+    def advance(self, target):
+        if self.doc is not None and self.doc < target:
+            self.doc = self.find(target)
+        return self.doc
+
+
+class AllCursor(Cursor):
+    """ All the doc_ids in [start, stop) """
+
+    def __init__(self, start, stop):
+        self.stop = stop
+        self.doc = start if start < stop else None
+
+    def advance(self, target):
+        if self.doc is not None and self.doc < target:
+            self.doc = target if target < self.stop else None
+        return self.doc
+
+
+class AndCursor(Cursor):
+    """ Conjunction : all children are leapfrogged to the same doc_id """
+
+    def __init__(self, children):
+        self.children = children
+        self.doc = -1
+        self.advance(0)
+
+    def advance(self, target):
+        if self.doc is None or self.doc >= target:
+            return self.doc
+        while True:
+            for child in self.children:
+                doc = child.advance(target)
+                if doc is None:
+                    self.doc = None
+                    return None
+                if doc > target:
+                    target = doc
+                    break
+            else:
+                self.doc = target
+                return target
+
+
+class OrCursor(Cursor):
+    """ Disjunction : the current doc_id is the smallest one of the children """
+
+    def __init__(self, children):
+        self.children = children
+        self.doc = -1
+        self.advance(0)
+
+    def advance(self, target):
+        if self.doc is None or self.doc >= target:
+            return self.doc
+        docs = [doc for doc in (child.advance(target) for child in self.children) if doc is not None]
+        self.doc = min(docs) if docs else None
+        return self.doc
+
+
+class DifferenceCursor(Cursor):
+    """ Documents of included that are not in excluded """
+
+    def __init__(self, included, excluded):
+        self.included = included
+        self.excluded = excluded
+        self.doc = -1
+        self.advance(0)
+
+    def advance(self, target):
+        if self.doc is None or self.doc >= target:
+            return self.doc
+        doc = self.included.advance(target)
+        while doc is not None and self.excluded.advance(doc) == doc:
+            doc = self.included.advance(doc + 1)
+        self.doc = doc
+        return doc
+
+
+def compile_query(tree, index):
+    """ Build the cursor that evaluates tree lazily on index (only postings lists of the terms are read) """
+    kind = tree[0]
+    if kind == 'term':
+        postings = index.find_postings(tree[1])
+        return BitmapCursor(postings) if isinstance(postings, BitmapPostings) else TermCursor(postings)
+    if kind == 'or':
+        return OrCursor([compile_query(child, index) for child in tree[1]])
+    if kind == 'not':
+        return DifferenceCursor(AllCursor(*index.get_document_range()), compile_query(tree[1], index))
+
+    # Negated operands of a conjunction are subtracted from the conjunction of the others
+    positives = [child for child in tree[1] if child[0] != 'not']
+    negatives = [child[1] for child in tree[1] if child[0] == 'not']
+    if len(positives) == 0:
+        included = AllCursor(*index.get_document_range())
+    elif len(positives) == 1:
+        included = compile_query(positives[0], index)
+    else:
+        included = AndCursor([compile_query(child, index) for child in positives])
+    if len(negatives) == 0:
+        return included
+    excluded = compile_query(negatives[0], index) if len(negatives) == 1 else \
+        OrCursor([compile_query(child, index) for child in negatives])
+    return DifferenceCursor(included, excluded)
+
+
+def iterate(cursor):
+    """ Stream the doc_ids of a cursor in increasing order """
+    doc = cursor.advance(0)
+    while doc is not None:
+        yield doc
+        doc = cursor.advance(doc + 1)
+
+
+def evaluate(text, index, limit=None):
+    """ doc_ids matching the boolean expression text, stopping after the first limit ones if limit is given """
+    docs = iterate(compile_query(parse_query(text), index))
+    return list(itertools.islice(docs, limit))
@@ -1,4 +1,7 @@
 from src.searching.index_reader import DocIDIndex
+from src.searching.query_planner import QueryPlan
+from src.searching import bool_parser
+import src.searching.partitioned_search as ps
 from config import QUERIES_DIR
 import os
 
@@ -55,6 +58,7 @@ def start_search_engine_cli(collection_name, index=None):
             answer = input().lower()
         if answer == 'n':
             running = False
+    index.close()
     print("")
 
 
@@ -100,30 +104,28 @@ def display_query(query):
     print('_ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _\n')
 
 
-def search_for_query(query, index):
-    """ Run a boolean search in index for given query """
-    relevant_docs = set()
+def search_for_query(query, index, explain=False):
+    """ Run a boolean search in index for given query (and display its plan of execution if explain is True) """
+    if index.is_partitioned():
+        return ps.search_partitions(index).bool_search(query, explain)
+    plan = QueryPlan(query, index)
+    relevant_docs = plan.execute()
+    if explain:
+        print(plan.explain())
 
-    for clause in query:
-        clause = sorted(clause, key=lambda x: 1 if x.startswith('-') else 0)
-
-        first_term = clause[0]
-        if not first_term.startswith('-'):
-            docs = index.find_documents(first_term.lower())
-        else:
-            docs = index.get_all_documents() - index.find_documents(first_term[1:].lower())
-
-        for term in clause[1:]:
-            if len(docs) == 0:
-                break
-            if not term.startswith('-'):
-                docs = docs & index.find_documents(term.lower())
-            else:
-                docs = docs - index.find_documents(term[1:].lower())
+    return index.get_documents_from_ids(sorted(relevant_docs))
 
-        relevant_docs = relevant_docs | docs
 
-    return index.get_documents_from_ids(sorted(relevant_docs))
+def search_for_expression(expression, index, limit=None):
+    """
+        Run a boolean search for a general expression with AND, OR, NOT, parentheses and implicit AND
+        (e.g. 'operating (system OR -kernel) NOT ibm'). Results are streamed in doc_id order without intermediate sets,
+        so that asking for the first limit results doesn't evaluate the whole expression
+    """
+    if index.is_partitioned():
+        return ps.search_partitions(index).expression_search(expression, limit)
+    doc_ids = bool_parser.evaluate(expression, index, limit)
+    return index.get_documents_from_ids(doc_ids)
 
 
 def display_result(list):
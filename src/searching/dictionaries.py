@@ -0,0 +1,99 @@
+from array import array
+
+
+class Lexicon:
+    """
+        In-memory dictionary of the terms of an index (term -> term_id).
+        It is loaded once from terms.txt so that looking for a term no longer means scanning this file
+    """
+
+    def __init__(self, path):
+        self.term_ids = dict()
+        with open(path, 'r') as f:
+            for line in f:
+                term, term_id = line.split()
+                self.term_ids[term] = int(term_id)
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    def get_id(self, term):
+        return self.term_ids.get(term, -1)
+
+    def get_ids(self, terms):
+        # Terms are returned in lexicographic order, like they are stored in terms.txt
+        return {term: self.term_ids[term] for term in sorted(set(terms)) if term in self.term_ids}
+
+
+class DocumentTable:
+    """
+        In-memory dictionary of the documents of an index, loaded once from documents.txt.
+        Document ids are dense, so names are stored in a list indexed by doc_id; the reverse mapping
+        (name -> doc_id) is only built the first time it is needed
+    """
+
+    def __init__(self, path):
+        self.names = list()
+        self._doc_ids = None
+        with open(path, 'r') as f:
+            for line in f:
+                name, doc_id = line.split()
+                doc_id = int(doc_id)
+                if doc_id >= len(self.names):
+                    self.names.extend([""] * (doc_id + 1 - len(self.names)))
+                self.names[doc_id] = name
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_name(self, doc_id):
+        return self.names[doc_id]
+
+    def get_names(self, doc_ids):
+        return [self.names[doc_id] for doc_id in doc_ids]
+
+    def get_id(self, name):
+        if self._doc_ids is None:
+            self._doc_ids = {name: doc_id for doc_id, name in enumerate(self.names)}
+        return self._doc_ids.get(str(name), -1)
+
+
+class PostingsDirectory:
+    """
+        Position of the postings list of each term in the inverted index file (term_id -> (offset, length, doc_freq)).
+        Term ids are dense, so the directory is stored as three arrays indexed by term_id.
+        The directories of the shards of an index can be loaded together, each term_id being in only one shard
+        (offsets are then positions in the file of the shard of the term)
+    """
+
+    def __init__(self, *paths):
+        self.offsets = array('q')
+        self.lengths = array('q')
+        self.doc_freqs = array('q')
+        for path in paths:
+            with open(path, 'r') as f:
+                for line in f:
+                    term_id, offset, length, doc_freq = map(int, line.split())
+                    missing = term_id + 1 - len(self.offsets)
+                    if missing > 0:
+                        self.offsets.extend([-1] * missing)
+                        self.lengths.extend([0] * missing)
+                        self.doc_freqs.extend([0] * missing)
+                    self.offsets[term_id] = offset
+                    self.lengths[term_id] = length
+                    self.doc_freqs[term_id] = doc_freq
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, term_id):
+        return 0 <= term_id < len(self.offsets) and self.offsets[term_id] >= 0
+
+    def get(self, term_id):
+        return self.offsets[term_id], self.lengths[term_id], self.doc_freqs[term_id]
+
+    def get_doc_freq(self, term_id):
+        return self.doc_freqs[term_id] if term_id in self else 0
@@ -1,6 +1,23 @@
+import copy
+import math
 import os
 from config import RES_DIR
 from gensim.parsing.porter import PorterStemmer
+from src.searching.dictionaries import Lexicon, DocumentTable, PostingsDirectory
+from src.searching.mapped_postings import MappedPostings, ShardedPostings
+from src.searching.postings import PostingList, BitmapPostings, make_postings
+from src.searching.statistics import CollectionStats, DocNorms, TermBounds, read_combinations
+import src.searching.weightings as w
+
+
+def read_parts(path):
+    """ Parts of an index listed in shards.txt or partitions.txt : [(start, stop, index_file, arrays_file), ...] """
+    parts = list()
+    with open(path, 'r') as f:
+        for line in f:
+            start, stop, *files = line.split()
+            parts.append((int(start), int(stop), files[0], files[1] if len(files) > 1 else None))
+    return parts
 
 
 class IndexReader:
@@ -13,33 +30,185 @@ class IndexReader:
     def __init__(self, type, collection):
         self.collection = collection
         self.index_type = 'Index_%s' % type
+        self.index_file = 'index'
+        self._lexicon = None
+        self._documents = None
+        self._directory = None
+        self._stats = None
+        self._metadata = None
+        self._arrays = None
+        self._shards = None
+        self._partitions = None
+        self.doc_range = None  # [start, stop) of the doc_ids of the partition read, None for a whole index
+        self.partitioned_search = None  # PartitionedSearch used by the search engines if the index is partitioned
+
+    def __getstate__(self):
+        # Mapped files and pools of workers are not sent to other processes, mapped files are mapped again there
+        state = dict(self.__dict__)
+        state['_arrays'] = None
+        state['partitioned_search'] = None
+        return state
+
+    @property
+    def lexicon(self):
+        """ Dictionary of terms, loaded on first use and then kept in memory for all the lookups of this reader """
+        if self._lexicon is None:
+            path = os.path.join(RES_DIR, self.index_type, self.collection, 'terms.txt')
+            self._lexicon = Lexicon(path)
+        return self._lexicon
+
+    @property
+    def documents(self):
+        """ Dictionary of documents (doc_id <-> name), loaded on first use """
+        if self._documents is None:
+            path = os.path.join(RES_DIR, self.index_type, self.collection, 'documents.txt')
+            self._documents = DocumentTable(path)
+        return self._documents
+
+    @property
+    def shards(self):
+        """
+            Parts of the inverted index, as (first term_id, stop term_id, index file, arrays file) : read in shards.txt
+            for indexes partitioned by ranges of term_ids, otherwise the whole index is one shard
+        """
+        if self._shards is None:
+            path = os.path.join(RES_DIR, self.index_type, self.collection, 'shards.txt')
+            if os.path.exists(path):
+                self._shards = read_parts(path)
+            elif self.is_partitioned():
+                raise ValueError("index %s of %s is partitioned by documents (partitions.txt) : search it with "
+                                 "PartitionedSearch or the partition readers" % (self.index_type, self.collection))
+            else:
+                self._shards = [(0, math.inf, self.index_file, 'postings')]
+        return self._shards
+
+    @property
+    def partitions(self):
+        """ Document partitions of the index, as (first doc_id, stop doc_id, index file, arrays file) """
+        if self._partitions is None:
+            path = os.path.join(RES_DIR, self.index_type, self.collection, 'partitions.txt')
+            self._partitions = read_parts(path) if os.path.exists(path) else list()
+        return self._partitions
+
+    def close(self):
+        """ Stop the workers of the PartitionedSearch started for this index, if any (started again if needed) """
+        if self.partitioned_search is not None:
+            self.partitioned_search.close()
+            self.partitioned_search = None
+
+    def is_partitioned(self):
+        """ True if this reader is on a whole index built in document partitions, which has no postings of its own """
+        return self.doc_range is None and len(self.partitions) > 0
+
+    def partition(self, number):
+        """
+            Reader of one document partition of the index : postings lists of its documents only,
+            but dictionaries and statistics of the whole collection (shared with this reader)
+        """
+        # Loaded before the copy so that all the partitions share them (readers sent together to a process keep
+        # sharing them there). Norms and bounds are cached in dicts that are shared as well
+        self.load_collection_structures()
+        start, stop, index_file, arrays_file = self.partitions[number]
+        reader = copy.copy(self)
+        reader._shards = [(0, math.inf, index_file, arrays_file)]
+        reader._directory = None
+        reader._arrays = None
+        reader.partitioned_search = None
+        reader.doc_range = (start, stop)
+        return reader
+
+    def load_collection_structures(self):
+        """ Load the dictionaries and statistics of the whole collection, common to all the partitions """
+        return self.lexicon, self.documents, self.stats
+
+    @property
+    def directory(self):
+        """ Offsets of the postings lists in the inverted index (in all its shards), loaded on first use """
+        if self._directory is None:
+            folder = os.path.join(RES_DIR, self.index_type, self.collection)
+            paths = [os.path.join(folder, index_file + '_dir.txt') for _, _, index_file, _ in self.shards]
+            self._directory = PostingsDirectory(*paths)
+        return self._directory
+
+    @property
+    def stats(self):
+        """ Collection statistics (number of documents, document frequencies...), loaded on first use """
+        if self._stats is None:
+            path = os.path.join(RES_DIR, self.index_type, self.collection, 'stats.bin')
+            self._stats = CollectionStats(path)
+        return self._stats
+
+    @property
+    def arrays(self):
+        """ Postings lists mapped in memory as NumPy arrays, or None if the index has not been written this way """
+        if self._arrays is None:
+            folder = os.path.join(RES_DIR, self.index_type, self.collection)
+            paths = [(start, os.path.join(folder, arrays_file)) for start, _, _, arrays_file in self.shards
+                     if arrays_file is not None]
+            if len(paths) < len(self.shards) or not all(os.path.exists(path + '_dir.bin') for _, path in paths):
+                self._arrays = False
+            elif len(paths) == 1:
+                self._arrays = MappedPostings(paths[0][1])
+            else:
+                self._arrays = ShardedPostings([(start, MappedPostings(path)) for start, path in paths])
+        return self._arrays or None
+
+    @property
+    def metadata(self):
+        """ Description of the format of the index files (meta.txt), empty for indexes built before it existed """
+        if self._metadata is None:
+            self._metadata = dict()
+            path = os.path.join(RES_DIR, self.index_type, self.collection, 'meta.txt')
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    for line in f:
+                        key, value = line.split(maxsplit=1)
+                        self._metadata[key] = value.strip()
+        return self._metadata
+
+    @property
+    def format_version(self):
+        return int(self.metadata.get('format_version', 1))
+
+    def read_entries(self, file_name, directory, ids):
+        """ Read in an index file only the entries of the given ids, by seeking straight to their offsets """
+        path = os.path.join(RES_DIR, self.index_type, self.collection, file_name + '.txt')
+        entries = {}
+        with open(path, 'rb') as index:
+            for id in sorted(ids):
+                if id in directory:
+                    offset, length, count = directory.get(id)
+                    index.seek(offset)
+                    entries[id] = index.read(length)
+        return entries
+
+    def read_postings(self, term_ids):
+        """ Entries of the given term_ids, each one read in the shard of the index that holds it """
+        if len(self.shards) == 1:
+            return self.read_entries(self.shards[0][2], self.directory, term_ids)
+        term_ids = list(term_ids)
+        entries = dict()
+        for start, stop, index_file, _ in self.shards:
+            shard_ids = [term_id for term_id in term_ids if start <= term_id < stop]
+            if shard_ids:
+                entries.update(self.read_entries(index_file, self.directory, shard_ids))
+        return entries
+
+    def get_postings_arrays(self, term_id):
+        """ Zero-copy views (doc_ids, freqs) on the postings list of term_id, or None without mapped postings """
+        return self.arrays.get(term_id) if self.arrays is not None else None
 
     def get_id_for_term(self, term):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'terms.txt')
-        with open(path, 'r') as terms:
-            for line in terms:
-                if line.split()[0] == term:
-                    return int(line.split()[1])
-        return -1
+        return self.lexicon.get_id(term)
 
     def get_ids_for_terms(self, terms):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'terms.txt')
-        term_ids = {}
-        with open(path, 'r') as f_terms:
-            for line in f_terms:
-                if line.split()[0] in terms:
-                    term_ids[line.split()[0]] = int(line.split()[1])
-        return term_ids
+        return self.lexicon.get_ids(terms)
 
     def get_documents_from_ids(self, doc_ids):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'documents.txt')
-        doc_names = [""] * len(doc_ids)
-        with open(path, 'r') as documents:
-            for line in documents:
-                if int(line.split()[1]) in doc_ids:
-                    rank = doc_ids.index(int(line.split()[1]))
-                    doc_names[rank] = line.split()[0]
-        return doc_names
+        return self.documents.get_names(doc_ids)
+
+    def get_id_for_document(self, doc_name):
+        return self.documents.get_id(doc_name)
 
     def find_documents(self, term):
         raise NotImplementedError
@@ -47,10 +216,15 @@ class IndexReader:
     def get_related_documents(self, term_id):
         raise NotImplementedError
 
+    def count_documents(self):
+        return self.stats.nb_documents
+
+    def get_document_range(self):
+        """ [start, stop) of the doc_ids searched by this reader """
+        return self.doc_range or (0, self.stats.nb_documents)
+
     def get_all_documents(self):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'documents.txt')
-        with open(path, 'r') as f:
-            return set(range(len(f.readlines())))
+        return set(range(*self.get_document_range()))
 
 
 class DocIDIndex(IndexReader):
@@ -69,12 +243,54 @@ class DocIDIndex(IndexReader):
         docs = self.get_related_documents(term_id)
         return set(docs)
 
+    def find_postings(self, term, stemming=False):
+        """ Same as find_documents, but documents are returned as a sorted PostingList with skip pointers """
+        stemmer = PorterStemmer()
+        if stemming:
+            term = stemmer.stem(term)
+        term_id = self.get_id_for_term(term)
+        if term_id < 0:
+            return PostingList([])
+        return self.get_related_postings(term_id)
+
+    def get_doc_freq(self, term, stemming=False):
+        """ Number of documents containing term, known from the postings directory without reading the postings """
+        stemmer = PorterStemmer()
+        if stemming:
+            term = stemmer.stem(term)
+        term_id = self.get_id_for_term(term)
+        return self.directory.get_doc_freq(term_id) if term_id >= 0 else 0
+
+    def get_all_postings(self):
+        if self.doc_range is not None:
+            start, stop = self.doc_range
+            return BitmapPostings(((1 << stop) - 1) & ~((1 << start) - 1), self.stats.nb_documents)
+        return BitmapPostings(0, self.stats.nb_documents).complement()
+
+    def get_related_postings(self, term_id):
+        """ Postings list of term_id in the container suited to its density (see src.searching.postings) """
+        if self.arrays is not None:
+            # Dense lists are read as written bitmaps, sparse ones are searched directly in the mapped array
+            bitmap = self.arrays.get_bitmap(term_id)
+            if bitmap is not None:
+                return BitmapPostings.from_bytes(bitmap, self.stats.nb_documents)
+            doc_ids, freqs = self.arrays.get(term_id)
+            return make_postings(doc_ids, self.stats.nb_documents)
+        line = self.read_postings([term_id]).get(term_id, b'')
+        ids = line.split()[1:]
+        if len(ids) > 0 and ids[0].startswith(b'b'):
+            return BitmapPostings.from_hex(ids[0][1:], self.stats.nb_documents)
+        return make_postings(list(map(int, ids)), self.stats.nb_documents)
+
     def get_related_documents(self, term_id):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'index.txt')
-        with open(path, 'r') as index:
-            for line in index:
-                if line.split()[0] == str(term_id):
-                    return map(int, line.split()[1:])
+        if self.arrays is not None:
+            doc_ids, freqs = self.arrays.get(term_id)
+            return iter(doc_ids.tolist())
+        line = self.read_postings([term_id]).get(term_id, b'')
+        ids = line.split()[1:]
+        if len(ids) > 0 and ids[0].startswith(b'b'):
+            return iter(BitmapPostings.from_hex(ids[0][1:], self.stats.nb_documents))
+        return map(int, ids)
 
 
 class FreqIndex(IndexReader):
@@ -82,34 +298,86 @@ class FreqIndex(IndexReader):
 
     def __init__(self, collection):
         IndexReader.__init__(self, 'Freq', collection)
+        self.doc_index_file = 'doc_index'
+        self._doc_norms = dict()
+        self._term_bounds = dict()
+        self._doc_directory = None
+        self._forward = None
+
+    def __getstate__(self):
+        state = IndexReader.__getstate__(self)
+        state['_forward'] = None
+        return state
+
+    def load_collection_structures(self):
+        return IndexReader.load_collection_structures(self) + (self.doc_directory,)
+
+    @property
+    def doc_directory(self):
+        """ Offsets of the documents in the non inversed index, None for indexes written without this directory """
+        if self._doc_directory is None:
+            path = os.path.join(RES_DIR, self.index_type, self.collection, self.doc_index_file + '_dir.txt')
+            self._doc_directory = PostingsDirectory(path) if os.path.exists(path) else False
+        return self._doc_directory or None
+
+    @property
+    def forward(self):
+        """ Non inversed index mapped in memory (term_ids and freqs of each doc_id), or None if it isn't written """
+        if self._forward is None:
+            path = os.path.join(RES_DIR, self.index_type, self.collection, 'forward')
+            self._forward = MappedPostings(path, 'terms') if os.path.exists(path + '_dir.bin') else False
+        return self._forward or None
 
     def find_documents(self, terms):
+        """
+            {term: (doc_freq, {doc_id: freq})} for the terms of the index. Document frequencies are those of the whole
+            collection, so that a partition of the index gives the same weights as the whole index
+        """
         term_ids = self.get_ids_for_terms(terms)
         terms_index = self.get_related_documents(term_ids.values())
-        return {term: terms_index[id] for term, id in term_ids.items()}
+        doc_freqs = self.get_all_doc_freqs()
+        return {term: (doc_freqs[id], terms_index[id][1] if id in terms_index else {}) for term, id in term_ids.items()}
 
     def get_related_documents(self, term_ids):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'index.txt')
         terms_index = {}
 
+        if self.arrays is not None:
+            for term_id in term_ids:
+                if term_id in self.arrays:
+                    doc_ids, freqs = self.arrays.get(term_id)
+                    terms_index[term_id] = (len(doc_ids), dict(zip(doc_ids.tolist(), freqs.tolist())))
+            return terms_index
+
         def extract_docs_freq(str):
-            return int(str.split(':')[0]), int(str.split(':')[1])
+            return int(str.split(b':')[0]), int(str.split(b':')[1])
 
-        with open(path, 'r') as index:
-            for line in index:
-                if int(line.split()[0]) in term_ids:
-                    count = int(line.split()[1])
-                    postings = dict(map(extract_docs_freq, line.split()[2:]))
-                    terms_index[int(line.split()[0])] = (count, postings)
+        for term_id, line in self.read_postings(term_ids).items():
+            count = int(line.split()[1])
+            postings = dict(map(extract_docs_freq, line.split()[2:]))
+            terms_index[term_id] = (count, postings)
         return terms_index
 
     def get_related_terms(self, doc_ids):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'doc_index.txt')
+        """ {doc_id: {term_id: freq}} for the given documents, read at their offsets in the non inversed index """
         docs_index = {}
 
+        if self.forward is not None:
+            for doc_id in doc_ids:
+                if doc_id in self.forward:
+                    term_ids, freqs = self.forward.get(doc_id)
+                    docs_index[doc_id] = dict(zip(term_ids.tolist(), freqs.tolist()))
+            return docs_index
+
         def extract_terms_freq(str):
             return int(str.split(':')[0]), int(str.split(':')[1])
 
+        if self.doc_directory is not None:
+            for doc_id, line in self.read_entries(self.doc_index_file, self.doc_directory, doc_ids).items():
+                docs_index[doc_id] = dict(map(extract_terms_freq, line.decode().split()[2:]))
+            return docs_index
+
+        # Indexes written without directory : the whole file is scanned
+        path = os.path.join(RES_DIR, self.index_type, self.collection, self.doc_index_file + '.txt')
         with open(path, 'r') as index:
             for line in index:
                 if int(line.split()[0]) in doc_ids:
@@ -118,11 +386,35 @@ class FreqIndex(IndexReader):
         return docs_index
 
     def get_all_doc_freqs(self):
-        path = os.path.join(RES_DIR, self.index_type, self.collection, 'index.txt')
-        doc_freqs = {}
+        """ Document frequencies indexed by term_id, taken from the collection statistics """
+        return self.stats.doc_freqs
 
-        with open(path, 'r') as index:
-            for line in index:
-                term_id, doc_count = line.split()[:2]
-                doc_freqs[int(term_id)] = int(doc_count)
-        return doc_freqs
+    def get_doc_norms(self, tf, idf):
+        """ Precomputed norms of documents for the weightings (tf, idf), or None if they have to be computed """
+        if tf not in w.TF_FUNCTIONS or idf not in w.IDF_FUNCTIONS:
+            return None
+        if (tf, idf) not in self._doc_norms:
+            path = os.path.join(RES_DIR, self.index_type, self.collection, 'norms.bin')
+            combination = '%s:%s' % (tf.__name__, idf.__name__)
+            if os.path.exists(path) and combination in read_combinations(path):
+                self._doc_norms[tf, idf] = DocNorms(path, combination, self.stats.nb_documents)
+            else:
+                self._doc_norms[tf, idf] = None
+        return self._doc_norms[tf, idf]
+
+    def get_term_bounds(self, tf, idf):
+        """ Precomputed upper bounds of the cosine contributions of terms for (tf, idf), or None if not available """
+        if tf not in w.TF_FUNCTIONS or idf not in w.IDF_FUNCTIONS:
+            return None
+        if (tf, idf) not in self._term_bounds:
+            path = os.path.join(RES_DIR, self.index_type, self.collection, 'bounds.bin')
+            combination = '%s:%s' % (tf.__name__, idf.__name__)
+            if os.path.exists(path) and combination in read_combinations(path):
+                self._term_bounds[tf, idf] = TermBounds(path, combination, self.stats.nb_terms)
+            else:
+                self._term_bounds[tf, idf] = None
+        return self._term_bounds[tf, idf]
+
+    def get_doc_freqs_summary(self, doc_id):
+        """ Stand-in for the frequencies of the terms of a document, made of its length and highest frequency """
+        return w.Summary(total=self.stats.doc_lengths[doc_id], maximum=self.stats.max_freqs[doc_id])
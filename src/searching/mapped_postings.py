@@ -0,0 +1,80 @@
+import bisect
+import mmap
+import os
+import numpy as np
+
+
+def map_array(path, dtype):
+    """ NumPy array viewing a binary file mapped in memory, without copying it """
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(buffer, dtype=dtype)
+
+
+class MappedPostings:
+    """
+        Postings lists written by ArraysWriter, mapped in memory : opening the index only maps the files,
+        and the postings lists of a term are slices of the arrays, read from the page cache when they are accessed.
+        Files = <path>_dir.bin (int64 rows "term_id start count"), <path>_docs.bin and <path>_freqs.bin (uint32),
+        and for DocID indexes the bitmaps of the dense lists (<path>_dense.bin and <path>_bitmaps.bin).
+        The forward index is read the same way, with lists of term_ids by doc_id (ids_name = 'terms')
+    """
+
+    def __init__(self, path, ids_name='docs'):
+        directory = map_array(path + '_dir.bin', '<i8').reshape(-1, 3)
+        self.keys, self.starts, self.counts = directory[:, 0], directory[:, 1], directory[:, 2]
+        self.ids = map_array('%s_%s.bin' % (path, ids_name), '<u4')
+        self.freqs = map_array(path + '_freqs.bin', '<u4') if os.path.exists(path + '_freqs.bin') else None
+        self.dense = map_array(path + '_dense.bin', '<i8') if os.path.exists(path + '_dense.bin') else self.keys[:0]
+        self.bitmaps = map_array(path + '_bitmaps.bin', 'u1').reshape(len(self.dense), -1) if len(self.dense) else None
+
+    def locate(self, key):
+        """ (start, count) of the list of key (term_id, or doc_id in the forward index) in the arrays, or None """
+        position = int(np.searchsorted(self.keys, key))
+        if position < len(self.keys) and self.keys[position] == key:
+            return int(self.starts[position]), int(self.counts[position])
+        return None
+
+    def __contains__(self, term_id):
+        return self.locate(term_id) is not None
+
+    def get(self, term_id):
+        """ Views (doc_ids, freqs) on the postings list of term_id, freqs being None for DocID indexes """
+        start, count = self.locate(term_id) or (0, 0)
+        freqs = self.freqs[start:start + count] if self.freqs is not None else None
+        return self.ids[start:start + count], freqs
+
+    def get_bitmap(self, term_id):
+        """ View on the bytes of the bitmap of term_id (see BitmapPostings), or None if its list isn't dense """
+        position = int(np.searchsorted(self.dense, term_id))
+        if position < len(self.dense) and self.dense[position] == term_id:
+            return self.bitmaps[position]
+        return None
+
+
+class ShardedPostings:
+    """
+        Mapped postings of an index partitioned by ranges of term_ids (see shards.txt) : same methods as
+        MappedPostings, each term_id being looked for in the shard of its range. shards = [(start, MappedPostings)...]
+    """
+
+    def __init__(self, shards):
+        self.starts = [start for start, postings in shards]
+        self.shards = [postings for start, postings in shards]
+
+    def shard(self, term_id):
+        return self.shards[max(0, bisect.bisect_right(self.starts, term_id) - 1)]
+
+    def locate(self, term_id):
+        return self.shard(term_id).locate(term_id)
+
+    def __contains__(self, term_id):
+        return term_id in self.shard(term_id)
+
+    def get(self, term_id):
+        return self.shard(term_id).get(term_id)
+
+    def get_bitmap(self, term_id):
+        return self.shard(term_id).get_bitmap(term_id)
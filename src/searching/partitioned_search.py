@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import heapq
+import itertools
+import pickle
+from src.searching.query_planner import QueryPlan
+from src.searching import bool_parser
+import src.searching.vect_search as vs
+import src.searching.weightings as w
+
+# Readers of the partitions of the indexes searched by the workers of the current process : index path -> readers
+_readers = dict()
+
+
+def open_partitions(key, readers):
+    _readers[key] = readers
+
+
+def bool_search_partition(key, number, query, explain=False):
+    """ Sorted doc_ids of a partition matching a boolean query (in normal disjunctive form), and its plan if asked """
+    plan = QueryPlan(query, _readers[key][number])
+    doc_ids = sorted(plan.execute())
+    return doc_ids, plan.explain() if explain else None
+
+
+def expression_search_partition(key, number, expression, limit):
+    """ First limit doc_ids of a partition matching a general boolean expression """
+    return bool_parser.evaluate(expression, _readers[key][number], limit)
+
+
+def vect_search_partition(key, number, query_tokens, tf, idf, rsv, k):
+    """ k best documents (score, doc_id) of a partition, scored with the statistics of the whole collection """
+    return vs.rank_documents(query_tokens, _readers[key][number], tf, idf, rsv, k)
+
+
+class PartitionedSearch:
+    """
+        Scatter-gather search on an index built in document partitions (e.g. DocBSBI(collection, partitions=10)) :
+        each query is sent to a pool of workers that search the partitions in parallel, each on the postings lists
+        of its documents only, then their results are merged. Doc_ids and term_ids are global, and weights are
+        computed with the document frequencies of the whole collection, so results are the same as with one index :
+        - boolean search : union of the results of the partitions (disjoint ranges of doc_ids)
+        - vectorial search : global top k among the k best documents of each partition
+        Weighting functions that are not picklable (e.g. made with weightings.custom) can't be sent to process
+        workers : the partitions are then searched one after the other in the current process
+    """
+
+    def __init__(self, index, workers=None, executor='process'):
+        if executor not in ['thread', 'process']:
+            raise ValueError("unknown executor '%s', expected 'thread' or 'process'" % executor)
+        if len(index.partitions) == 0:
+            raise ValueError("index %s of %s has no partitions" % (index.index_type, index.collection))
+        self.index = index
+        self.key = (index.index_type, index.collection)
+        self.readers = [index.partition(number) for number in range(len(index.partitions))]
+        self.processes = executor == 'process'
+        workers = workers or len(self.readers)
+        pool = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        self.executor = pool(workers, initializer=open_partitions, initargs=(self.key, self.readers))
+
+    def scatter(self, search, *args):
+        """ Run search on every partition in the workers and return their results, in the order of the partitions """
+        numbers = range(len(self.readers))
+        if self.processes and not picklable(args):
+            open_partitions(self.key, self.readers)
+            return [search(self.key, number, *args) for number in numbers]
+        futures = [self.executor.submit(search, self.key, number, *args) for number in numbers]
+        return [future.result() for future in futures]
+
+    def bool_search(self, query, explain=False):
+        # Partitions hold consecutive ranges of doc_ids : their sorted results follow each other
+        results = self.scatter(bool_search_partition, query, explain)
+        for number, (doc_ids, plan) in enumerate(results):
+            if explain:
+                print("Partition %d :\n%s" % (number, plan))
+        doc_ids = itertools.chain.from_iterable(doc_ids for doc_ids, plan in results)
+        return self.index.get_documents_from_ids(list(doc_ids))
+
+    def expression_search(self, expression, limit=None):
+        doc_ids = itertools.chain.from_iterable(self.scatter(expression_search_partition, expression, limit))
+        return self.index.get_documents_from_ids(list(itertools.islice(doc_ids, limit)))
+
+    def vect_search(self, query_tokens, tf=w.tf, idf=w.idf, rsv=w.rsv_cos, k=100):
+        results = itertools.chain.from_iterable(self.scatter(vect_search_partition, query_tokens, tf, idf, rsv, k))
+        best_docs = heapq.nlargest(k, results, key=lambda result: (result[0], -result[1]))
+        return self.index.get_documents_from_ids([doc_id for doc_score, doc_id in best_docs])
+
+    def close(self):
+        """ Stop the workers, the search can't be used anymore """
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def picklable(args):
+    try:
+        pickle.dumps(args)
+        return True
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+
+
+def search_partitions(index):
+    """
+        PartitionedSearch of a partitioned index, started on its first query and kept with the index for the others
+        until index.close()
+    """
+    if index.partitioned_search is None:
+        index.partitioned_search = PartitionedSearch(index)
+    return index.partitioned_search
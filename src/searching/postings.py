@@ -0,0 +1,170 @@
+import bisect
+import math
+
+
+class PostingList:
+    """
+        Sorted list of doc_ids with skip pointers every sqrt(n) entries.
+        advance() gallops over the skip pointers then searches inside one block, so that intersecting a short list
+        with a long one costs about the size of the short list
+    """
+
+    def __init__(self, doc_ids):
+        self.doc_ids = doc_ids
+        self.step = max(1, int(math.sqrt(len(doc_ids))))
+        self.skips = doc_ids[::self.step]  # first doc_id of each block
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def __getitem__(self, position):
+        return self.doc_ids[position]
+
+    def advance(self, position, target):
+        """ Return the first position >= position whose doc_id is >= target (len(self) if there is none) """
+        if position >= len(self.doc_ids) or self.doc_ids[position] >= target:
+            return position
+
+        # Gallop over the skip pointers, starting from the block of position
+        block = position // self.step
+        jump = 1
+        while block + jump < len(self.skips) and self.skips[block + jump] <= target:
+            block += jump
+            jump *= 2
+        block = bisect.bisect_right(self.skips, target, block, min(block + jump, len(self.skips))) - 1
+
+        start = max(position, block * self.step)
+        end = min((block + 1) * self.step, len(self.doc_ids))
+        return bisect.bisect_left(self.doc_ids, target, start, end)
+
+    def contains(self, position, doc_id):
+        """ Advance to doc_id and return (new position, whether doc_id is in the list) """
+        position = self.advance(position, doc_id)
+        return position, position < len(self.doc_ids) and self.doc_ids[position] == doc_id
+
+
+class BitmapPostings:
+    """
+        Dense posting list stored as a bitmap : bit doc_id of a Python int is set if the document contains the term.
+        Boolean algebra between bitmaps (and, or, complement) is done on whole ints, and testing one document
+        is a lookup in the bytes of the bitmap
+    """
+
+    def __init__(self, bits, nb_documents):
+        self.bits = bits
+        self.nb_documents = nb_documents
+        self._count = None
+        self._bytes = None
+
+    @classmethod
+    def from_doc_ids(cls, doc_ids, nb_documents):
+        data = bytearray((nb_documents + 7) // 8)
+        for doc_id in doc_ids:
+            data[doc_id >> 3] |= 1 << (doc_id & 7)
+        return cls(int.from_bytes(data, 'little'), nb_documents)
+
+    @classmethod
+    def from_bytes(cls, data, nb_documents):
+        """ Bitmap from its bytes (bit doc_id & 7 of byte doc_id >> 3), e.g. a view on a mapped file """
+        return cls(int.from_bytes(data, 'little'), nb_documents)
+
+    @classmethod
+    def from_hex(cls, hex_bits, nb_documents):
+        return cls(int(hex_bits, 16), nb_documents)
+
+    def to_hex(self):
+        return format(self.bits, 'x')
+
+    @property
+    def bytes(self):
+        if self._bytes is None:
+            self._bytes = self.bits.to_bytes((self.nb_documents + 7) // 8, 'little')
+        return self._bytes
+
+    def __len__(self):
+        if self._count is None:
+            self._count = bin(self.bits).count('1')
+        return self._count
+
+    def __iter__(self):
+        for i, byte in enumerate(self.bytes):
+            if byte:
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        yield 8 * i + bit
+
+    def contains(self, position, doc_id):
+        """ Same signature as PostingList.contains, the position is not needed to test a bit """
+        return position, doc_id < self.nb_documents and bool(self.bytes[doc_id >> 3] >> (doc_id & 7) & 1)
+
+    def complement(self):
+        return BitmapPostings(((1 << self.nb_documents) - 1) & ~self.bits, self.nb_documents)
+
+
+# Posting lists containing at least this fraction of the collection are stored as bitmaps
+BITMAP_MIN_DENSITY = 1 / 16
+
+
+def is_dense(doc_freq, nb_documents):
+    return nb_documents > 0 and doc_freq >= BITMAP_MIN_DENSITY * nb_documents
+
+
+def make_postings(doc_ids, nb_documents):
+    """ Choose the container of a sorted list of doc_ids : array with skip pointers if sparse, bitmap if dense """
+    if is_dense(len(doc_ids), nb_documents):
+        return BitmapPostings.from_doc_ids(doc_ids, nb_documents)
+    return PostingList(doc_ids)
+
+
+def to_bitmap(posting_list, nb_documents):
+    if isinstance(posting_list, BitmapPostings):
+        return posting_list
+    return BitmapPostings.from_doc_ids(posting_list, nb_documents)
+
+
+def intersect(posting_lists):
+    """ Intersection of posting lists : the shortest list drives the search and the longer ones are galloped through """
+    if len(posting_lists) == 0:
+        return PostingList([])
+    if all(isinstance(posting_list, BitmapPostings) for posting_list in posting_lists):
+        bits = posting_lists[0].bits
+        for posting_list in posting_lists[1:]:
+            bits &= posting_list.bits
+        return BitmapPostings(bits, posting_lists[0].nb_documents)
+    posting_lists = sorted(posting_lists, key=len)
+    shortest, others = posting_lists[0], posting_lists[1:]
+    positions = [0] * len(others)
+    result = list()
+
+    for doc_id in shortest:
+        for i, posting_list in enumerate(others):
+            positions[i], found = posting_list.contains(positions[i], doc_id)
+            if not found:
+                break
+        else:
+            result.append(doc_id)
+    return PostingList(result)
+
+
+def difference(posting_list, excluded_lists):
+    """ Documents of posting_list that are in none of the excluded lists """
+    if isinstance(posting_list, BitmapPostings):
+        bits = posting_list.bits
+        for excluded in excluded_lists:
+            bits &= ~to_bitmap(excluded, posting_list.nb_documents).bits
+        return BitmapPostings(bits, posting_list.nb_documents)
+
+    positions = [0] * len(excluded_lists)
+    result = list()
+
+    for doc_id in posting_list:
+        for i, excluded in enumerate(excluded_lists):
+            positions[i], found = excluded.contains(positions[i], doc_id)
+            if found:
+                break
+        else:
+            result.append(doc_id)
+    return PostingList(result)
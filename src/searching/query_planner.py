@@ -0,0 +1,115 @@
+import time
+from src.searching.postings import intersect, difference
+
+
+class Clause:
+    """ Conjunctive clause of a boolean query in DNF : terms that must appear (positives) and must not (negatives) """
+
+    def __init__(self, literals):
+        self.literals = literals
+        self.positives = frozenset(term.lower() for term in literals if not term.startswith('-'))
+        self.negatives = frozenset(term[1:].lower() for term in literals if term.startswith('-'))
+
+        self.cost = None
+        self.status = 'pending'
+        self.reason = ''
+        self.result_size = None
+        self.duration = None
+
+    def subsumes(self, other):
+        """ True if every document matching other also matches this clause """
+        return self.positives <= other.positives and self.negatives <= other.negatives
+
+    def __str__(self):
+        return ' AND '.join(sorted(self.positives) + ['NOT ' + term for term in sorted(self.negatives)])
+
+
+class QueryPlan:
+    """
+        Plan of execution of a boolean query in DNF. Document frequencies of all distinct terms are read once
+        in the postings directory, then :
+        - clauses that can't match anything (absent term, term both required and excluded) are dropped
+        - clauses subsumed by another clause (same terms and more) are skipped, their results being already included
+        - remaining clauses are evaluated from the cheapest to the most expensive one, each distinct term being fetched
+          at most once for the whole query
+        explain() tells what has been decided for each clause and why
+    """
+
+    def __init__(self, query, index):
+        self.index = index
+        self.clauses = [Clause(literals) for literals in query]
+        self.terms = set().union(*[clause.positives | clause.negatives for clause in self.clauses])
+        self.doc_freqs = {term: index.get_doc_freq(term) for term in self.terms}
+        self.nb_documents = index.count_documents()
+        self.postings = dict()
+        self.plan()
+
+    def estimate_cost(self, clause):
+        """ Number of postings that will be read : the rarest positive term drives the intersection """
+        positives = [self.doc_freqs[term] for term in clause.positives]
+        negatives = [self.doc_freqs[term] for term in clause.negatives]
+        driver = min(positives) if positives else self.nb_documents
+        return driver * max(1, len(positives)) + sum(negatives)
+
+    def plan(self):
+        kept = list()
+        for clause in self.clauses:
+            if any(self.doc_freqs[term] == 0 for term in clause.positives):
+                clause.status, clause.reason = 'empty', 'a required term is in no document'
+            elif clause.positives & clause.negatives:
+                clause.status, clause.reason = 'empty', 'a term is both required and excluded'
+            else:
+                clause.cost = self.estimate_cost(clause)
+                kept.append(clause)
+
+        self.order = list()
+        for i, clause in enumerate(kept):
+            # Among identical clauses, only the first one is kept
+            subsuming = next((c for j, c in enumerate(kept) if j != i and c.subsumes(clause)
+                              and not (clause.subsumes(c) and j > i)), None)
+            if subsuming is not None:
+                clause.status, clause.reason = 'skipped', 'subsumed by ( %s )' % subsuming
+            else:
+                self.order.append(clause)
+        self.order.sort(key=lambda c: c.cost)
+
+    def fetch(self, term):
+        if term not in self.postings:
+            self.postings[term] = self.index.find_postings(term)
+        return self.postings[term]
+
+    def execute(self):
+        """ Evaluate the planned clauses and return the set of matching doc_ids """
+        relevant_docs = set()
+
+        for clause in self.order:
+            start = time.time()
+            positives = sorted(clause.positives, key=lambda term: self.doc_freqs[term])
+            if positives:
+                docs = intersect([self.fetch(term) for term in positives])
+            else:
+                docs = self.index.get_all_postings()
+            if len(docs) > 0 and clause.negatives:
+                docs = difference(docs, [self.fetch(term) for term in sorted(clause.negatives)])
+            relevant_docs.update(docs)
+
+            clause.status = 'evaluated'
+            clause.result_size = len(docs)
+            clause.duration = time.time() - start
+
+        return relevant_docs
+
+    def explain(self):
+        lines = ["Plan (%i clauses, %i distinct terms, %i fetched)" % (len(self.clauses), len(self.terms),
+                                                                      len(self.postings))]
+        for term in sorted(self.terms):
+            lines.append("  df(%s) = %i" % (term, self.doc_freqs[term]))
+        for rank, clause in enumerate(self.order):
+            detail = "cost %i" % clause.cost
+            if clause.status == 'evaluated':
+                detail += ", %i results in %.4f s" % (clause.result_size, clause.duration)
+            lines.append("  %i) ( %s ) : %s, %s" % (rank + 1, clause, clause.status, detail))
+        for clause in self.clauses:
+            if clause.status in ['empty', 'skipped']:
+                lines.append("  -) ( %s ) : %s, %s" % (clause, clause.status, clause.reason))
+        return '\n'.join(lines)
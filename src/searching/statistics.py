@@ -0,0 +1,71 @@
+from array import array
+import struct
+import src.searching.weightings as w
+
+
+class CollectionStats:
+    """
+        Global statistics about an indexed collection, written at index time in stats.bin and loaded once by readers :
+        number of documents, document frequency and collection frequency of each term, length of each document
+        and highest frequency of a term in each document
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.nb_documents, self.nb_terms = struct.unpack('=II', f.read(struct.calcsize('=II')))
+            self.doc_freqs = array('I')
+            self.doc_freqs.fromfile(f, self.nb_terms)
+            self.collection_freqs = array('Q')
+            self.collection_freqs.fromfile(f, self.nb_terms)
+            self.doc_lengths = array('I')
+            self.doc_lengths.fromfile(f, self.nb_documents)
+            self.max_freqs = array('I')
+            self.max_freqs.fromfile(f, self.nb_documents)
+
+    @property
+    def avg_doc_length(self):
+        return sum(self.doc_lengths) / self.nb_documents if self.nb_documents > 0 else 0
+
+
+def read_combinations(path):
+    """ List the weightings "tf:idf" for which a file of precomputed values (norms.bin, bounds.bin) has entries """
+    with open(path, 'rb') as f:
+        return f.readline().decode().split()
+
+
+class DocNorms:
+    """
+        Sums (l1) and sums of squares (l2) of the weights of each document for one combination (tf, idf),
+        read from norms.bin where they have been precomputed at index time
+    """
+
+    def __init__(self, path, combination, nb_documents):
+        self.l1 = array('d')
+        self.l2 = array('d')
+        with open(path, 'rb') as f:
+            combinations = f.readline().decode().split()
+            position = combinations.index(combination)
+            f.seek(position * 2 * nb_documents * self.l1.itemsize, 1)
+            self.l1.fromfile(f, nb_documents)
+            self.l2.fromfile(f, nb_documents)
+
+    def get(self, doc_id):
+        return w.Summary(total=self.l1[doc_id], squares=self.l2[doc_id])
+
+
+class TermBounds:
+    """
+        Upper bound of the contribution of each term to the cosine score of a document (its highest weight
+        in a document divided by the norm of this document), for one combination (tf, idf), read from bounds.bin
+    """
+
+    def __init__(self, path, combination, nb_terms):
+        self.bounds = array('d')
+        with open(path, 'rb') as f:
+            combinations = f.readline().decode().split()
+            position = combinations.index(combination)
+            f.seek(position * nb_terms * self.bounds.itemsize, 1)
+            self.bounds.fromfile(f, nb_terms)
+
+    def get(self, term_id):
+        return self.bounds[term_id]
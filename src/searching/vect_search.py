@@ -1,8 +1,12 @@
 from src.searching.index_reader import FreqIndex
 import src.searching.weightings as w
+import src.searching.partitioned_search as ps
 from src.language_processing.processing import Collection
 from config import QUERIES_DIR
-from collections import Counter
+from collections import Counter, defaultdict
+import heapq
+import bisect
+import math
 import os
 
 
@@ -56,6 +60,7 @@ def start_search_engine_cli(collection_name, index=None, tf=w.tf, idf=w.idf, rsv
             answer = input().lower()
         if answer == 'n':
             running = False
+    index.close()
     print("")
 
 
@@ -72,15 +77,26 @@ def display_query(query_tokens):
     print('_ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _ _\n')
 
 
-def search_for_query(query_tokens, index, tf=w.tf, idf=w.idf, rsv=w.rsv_cos):
-    """ Run a vectorial search in index for given query by applying the model (tf, idf, rsv) """
+def search_for_query(query_tokens, index, tf=w.tf, idf=w.idf, rsv=w.rsv_cos, k=100):
+    """
+        Run a vectorial search in index for given query by applying the model (tf, idf, rsv) and return the k best
+        documents. Scores are accumulated term at a time for the candidate documents only
+    """
+    if index.is_partitioned():
+        return ps.search_partitions(index).vect_search(query_tokens, tf, idf, rsv, k)
+    best_docs = rank_documents(query_tokens, index, tf, idf, rsv, k)
+    return index.get_documents_from_ids([doc_id for doc_score, doc_id in best_docs])
+
+
+def rank_documents(query_tokens, index, tf=w.tf, idf=w.idf, rsv=w.rsv_cos, k=100):
+    """ Same search as search_for_query, but return the k best documents as (score, doc_id), best first """
 
     query_index = Counter()
     for token in query_tokens:
         query_index[token] += 1
 
-    total_docs = len(index.get_all_documents())
-    scores = [0] * total_docs
+    total_docs = index.count_documents()
+    scores = defaultdict(float)
     normalize_q = []
 
     terms_index = index.find_documents(query_index.keys())
@@ -88,8 +104,15 @@ def search_for_query(query_tokens, index, tf=w.tf, idf=w.idf, rsv=w.rsv_cos):
     for term, docs in terms_index.items():
         relevant_docs.update(docs[1].keys())
     relevant_docs = sorted(list(relevant_docs))
-    terms_by_doc = index.get_related_terms(relevant_docs)
-    all_doc_freqs = index.get_all_doc_freqs()
+
+    # Norms of documents are precomputed at index time for the weightings of w, otherwise whole vectors are read
+    doc_norms = index.get_doc_norms(tf, idf) if rsv in w.RSV_FUNCTIONS else None
+    if doc_norms is not None:
+        freqs_by_doc = {doc_id: index.get_doc_freqs_summary(doc_id) for doc_id in relevant_docs}
+    else:
+        terms_by_doc = index.get_related_terms(relevant_docs)
+        freqs_by_doc = {doc_id: terms.values() for doc_id, terms in terms_by_doc.items()}
+        all_doc_freqs = index.get_all_doc_freqs()
 
     for term in terms_index:
         doc_freq, postings = terms_index[term]
@@ -97,20 +120,105 @@ def search_for_query(query_tokens, index, tf=w.tf, idf=w.idf, rsv=w.rsv_cos):
         normalize_q.append(wq)
 
         for doc, freq in postings.items():
-            wd = tf(freq, terms_by_doc[doc].values()) * idf(doc_freq, total_docs)
+            wd = tf(freq, freqs_by_doc[doc]) * idf(doc_freq, total_docs)
             scores[doc] += wd * wq
 
     for doc_id in relevant_docs:
-        terms_dict = terms_by_doc[doc_id]
-        normalize_d = []
-        for term_id, freq_term in terms_dict.items():
-            wtd = tf(freq_term, terms_by_doc[doc_id].values()) * idf(all_doc_freqs[term_id], total_docs)
-            normalize_d.append(wtd)
+        if doc_norms is not None:
+            normalize_d = doc_norms.get(doc_id)
+        else:
+            normalize_d = []
+            for term_id, freq_term in terms_by_doc[doc_id].items():
+                wtd = tf(freq_term, freqs_by_doc[doc_id]) * idf(all_doc_freqs[term_id], total_docs)
+                normalize_d.append(wtd)
         scores[doc_id] = rsv(scores[doc_id], normalize_q, normalize_d)
 
-    sorted_docs = sorted(relevant_docs, key=lambda d: -scores[d])
+    # Best scores first, ties broken by doc_id
+    best_docs = heapq.nlargest(k, relevant_docs, key=lambda d: (scores[d], -d))
+
+    return [(scores[doc_id], doc_id) for doc_id in best_docs]
+
+
+def wand_search_for_query(query_tokens, index, tf=w.tf, idf=w.idf, rsv=w.rsv_cos, k=100):
+    """
+        Same results as search_for_query, but documents are evaluated one at a time by increasing doc_id (WAND) :
+        a document is skipped as soon as the upper bounds of the query terms it may contain can't bring it in the
+        current top k. Bounds are precomputed at index time for cosine similarity only, otherwise the exhaustive
+        search is used, as well as for partitioned indexes
+    """
+    if index.is_partitioned():
+        return search_for_query(query_tokens, index, tf, idf, rsv, k)
+    doc_norms = index.get_doc_norms(tf, idf)
+    term_bounds = index.get_term_bounds(tf, idf)
+    if rsv is not w.rsv_cos or doc_norms is None or term_bounds is None:
+        return search_for_query(query_tokens, index, tf, idf, rsv, k)
+
+    query_index = Counter()
+    for token in query_tokens:
+        query_index[token] += 1
 
-    return index.get_documents_from_ids(sorted_docs[:100])
+    total_docs = index.count_documents()
+    term_ids = index.get_ids_for_terms(query_index.keys())
+    terms_index = index.find_documents(query_index.keys())
+
+    weights_q = dict()
+    for term in terms_index:
+        doc_freq, postings = terms_index[term]
+        weights_q[term] = tf(query_index[term], query_index.values()) * idf(doc_freq, total_docs)
+    normalize_q = list(weights_q.values())
+    if any(wq < 0 for wq in normalize_q):
+        return search_for_query(query_tokens, index, tf, idf, rsv, k)
+    norm_q = math.sqrt(w.squares(normalize_q))
+
+    # Cursor on the postings list of each term = [doc_ids, position, upper bound of contribution]
+    cursors = list()
+    for term, (doc_freq, postings) in terms_index.items():
+        if len(postings) > 0 and norm_q > 0:
+            upper_bound = weights_q[term] / norm_q * term_bounds.get(term_ids[term])
+            cursors.append([list(postings), 0, upper_bound])
+
+    def score(doc_id):
+        doc_score = 0.0
+        for term in terms_index:
+            doc_freq, postings = terms_index[term]
+            if doc_id in postings:
+                wd = tf(postings[doc_id], index.get_doc_freqs_summary(doc_id)) * idf(doc_freq, total_docs)
+                doc_score += wd * weights_q[term]
+        return rsv(doc_score, normalize_q, doc_norms.get(doc_id))
+
+    top_docs = list()  # min-heap of (score, -doc_id)
+    while cursors:
+        cursors.sort(key=lambda c: c[0][c[1]])
+
+        # Pivot = first cursor where the sum of upper bounds could beat the k-th best score (with margin for rounding)
+        pivot = None
+        bound_sum = 0
+        for i, (doc_ids, position, upper_bound) in enumerate(cursors):
+            bound_sum += upper_bound
+            if len(top_docs) < k or bound_sum * (1 + 1e-9) > top_docs[0][0]:
+                pivot = i
+                break
+        if pivot is None:
+            break
+        pivot_doc = cursors[pivot][0][cursors[pivot][1]]
+
+        if cursors[0][0][cursors[0][1]] == pivot_doc:
+            candidate = (score(pivot_doc), -pivot_doc)
+            if len(top_docs) < k:
+                heapq.heappush(top_docs, candidate)
+            elif candidate > top_docs[0]:
+                heapq.heapreplace(top_docs, candidate)
+            for cursor in cursors:
+                if cursor[0][cursor[1]] == pivot_doc:
+                    cursor[1] += 1
+        else:
+            # No document before pivot_doc can enter the top k
+            for cursor in cursors[:pivot]:
+                cursor[1] = bisect.bisect_left(cursor[0], pivot_doc, cursor[1])
+        cursors = [cursor for cursor in cursors if cursor[1] < len(cursor[0])]
+
+    best_docs = [-doc_id for doc_score, doc_id in sorted(top_docs, reverse=True)]
+    return index.get_documents_from_ids(best_docs)
 
 
 def display_result(list):
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 
 def custom(func, **params):
@@ -7,9 +8,39 @@ def custom(func, **params):
     return custom_func
 
 
+class Summary:
+    """
+        Precomputed aggregates of a list of positive values (sum, sum of squares, max).
+        The weighting functions below accept it wherever they expect the list itself, so that the frequencies
+        and the weights of a document can be computed once at index time instead of being read at each query
+    """
+
+    def __init__(self, total=None, squares=None, maximum=None):
+        self.total = total
+        self.squares = squares
+        self.maximum = maximum
+
+
+def summarize(values):
+    values = list(values)
+    return Summary(total(values), squares(values), maximum(values) if values else 0)
+
+
+def total(values):
+    return values.total if isinstance(values, Summary) else sum(values)
+
+
+def squares(values):
+    return values.squares if isinstance(values, Summary) else sum(map(lambda x: x**2, values))
+
+
+def maximum(values):
+    return values.maximum if isinstance(values, Summary) else max(values)
+
+
 # Weighting functions for variants of Term Frequency
 def tf(freq, all_freqs):
-    return freq/sum(all_freqs)
+    return freq/total(all_freqs)
 
 
 def tf_binary(freq, all_freqs):
@@ -33,7 +64,7 @@ def tf_log1p(freq, all_freqs):
 
 
 def tf_norm(freq, all_freqs, k=0.0):
-    return k + (1-k) * freq/(max(all_freqs))
+    return k + (1-k) * freq/(maximum(all_freqs))
 
 
 # Weighting functions for variant of Inverse Document Frequency
@@ -63,28 +94,46 @@ def rsv_cos(score, wq, wd):
     """
     Compute similarity between query and document with cos mesure
     :param score: the product vect(wq) * vect(wd) that has already been computed
-    :param wq: list of positive weight for query (coords in query vect space)
-    :param wd: list of positive weight for document (coords in document vect space)
+    :param wq: list of positive weight for query (coords in query vect space), or its Summary
+    :param wd: list of positive weight for document (coords in document vect space), or its Summary
     :return: cos score
     """
-    nq = sum(map(lambda x: x**2, wq))
-    nd = sum(map(lambda x: x**2, wd))
+    nq = squares(wq)
+    nd = squares(wd)
     return score / (math.sqrt(nq) * math.sqrt(nd))
 
 
 def rsv_dice(score, wq, wd):
-    sq = sum(wq)
-    sd = sum(wd)
+    sq = total(wq)
+    sd = total(wd)
     return 2 * score / (sq + sd)
 
 
 def rsv_jaccard(score, wq, wd):
-    sq = sum(wq)
-    sd = sum(wd)
+    sq = total(wq)
+    sd = total(wd)
     return score / (sq + sd - score)
 
 
 def rsv_overlap(score, wq, wd):
-    sq = sum(wq)
-    sd = sum(wd)
+    sq = total(wq)
+    sd = total(wd)
     return score / min(sq, sd)
+
+
+# Weightings whose document norms can be precomputed at index time (see FreqBSBI.write_norms_to_disk)
+TF_FUNCTIONS = [tf, tf_binary, tf_id, tf_sqrt, tf_log, tf_log1p, tf_norm]
+IDF_FUNCTIONS = [idf, idf_unary, idf_log, idf_smooth, idf_proba]
+RSV_FUNCTIONS = [rsv_cos, rsv_dice, rsv_jaccard, rsv_overlap]
+
+# Same functions as TF_FUNCTIONS, computed with NumPy for all the postings of an index at once : freqs are the
+# frequencies of the postings (floats), totals and maxima the sum and the max of the frequencies of their documents
+TF_ARRAYS = {
+    tf: lambda freqs, totals, maxima: freqs / totals,
+    tf_binary: lambda freqs, totals, maxima: (freqs > 0).astype(float),
+    tf_id: lambda freqs, totals, maxima: freqs,
+    tf_sqrt: lambda freqs, totals, maxima: np.sqrt(freqs),
+    tf_log: lambda freqs, totals, maxima: np.where(freqs > 0, 1 + np.log(np.maximum(freqs, 1)), 0),
+    tf_log1p: lambda freqs, totals, maxima: np.log(1 + freqs),
+    tf_norm: lambda freqs, totals, maxima: freqs / maxima,
+}